@@ -14,6 +14,7 @@ from app.common import (
     backup_config,
     create_loc_config,
     display_conf,
+    int_to_date_log,
     list_backups,
     read_json_list,
     restore_config,
@@ -85,6 +86,12 @@ def admin(args: Namespace) -> None:  # pylint: disable=R0912
         select_restore_backup()
     if args.undo:
         select_log_undo(args.undo)
+    if args.prune_log:
+        msg.prune_log(sql.prune_log())
+    if args.restore_checkpoint:
+        select_checkpoint_restore()
+    if args.state_at:
+        select_state_at(args.state_at)
 
 
 def upgrade(force=False) -> None:
@@ -115,6 +122,31 @@ def select_log_undo(n: int):
     sql.undo(undo_date)
 
 
+def select_checkpoint_restore():
+    """restore state from selected checkpoint
+    same as undo, but without replaying the history
+    """
+    dates = sql.checkpoint_list()
+    if dates.empty:
+        msg.msg("no checkpoints. abort.")
+        sys.exit(0)
+    dates = dates[conf.CHECKPOINT_DATE].to_list()
+    idx = msg.select_checkpoint([int_to_date_log(d) for d in dates])
+    sql.undo(dates[idx])
+
+
+def select_state_at(tab: str, n: int = 9):
+    """show tab as before command selected from last n logs"""
+    logs = sql.log.log_read(n)
+    if logs.empty:
+        msg.msg("no commands in log.")
+        sys.exit(1)
+    log_no = msg.select_log(logs, state=True)
+    dat = sql.state_at(tab, logs.loc[log_no, conf.LOG_DATE])
+    dat = dat.drop(columns=conf.NO_EXPORT_COLS, errors="ignore")
+    msg.msg(dat.to_string(index=False) if not dat.empty else f"{tab} was empty.")
+
+
 def select_restore_backup():
     """ask which and then restore backup"""
     lb = list_backups()
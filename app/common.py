@@ -1,6 +1,7 @@
 """
 utility functions
-do not import from other files in project (except error.py & config.py)
+do not import from other files in project (except error.py, config.py, message.py
+& sql_connection.py)
 as this will cause circular import
 """
 
@@ -11,9 +12,10 @@ import re
 import shutil
 from datetime import datetime
 from json import JSONDecodeError
-from typing import Dict, List, NamedTuple, Set, Tuple, Union
+from typing import Any, Callable, Dict, List, NamedTuple, Set, Tuple, Union
 
 import pandas as pd
+from dateutil import tz
 
 import conf.config as conf
 from app.error import (
@@ -26,6 +28,7 @@ from app.error import (
     WriteJsonError,
 )
 from app.message import msg
+from app.sql_connection import connection
 
 
 class TypedItertuple(NamedTuple):
@@ -73,6 +76,8 @@ def backup_config() -> None:
         ]
     ]
     os.mkdir(backup_path)
+    # flush WAL into db file before copying
+    connection.close()
     for f in config_files:
         shutil.copy2(f, backup_path)
 
@@ -93,6 +98,8 @@ def restore_config(idx=-1) -> None:
     restore backup sql DB
     """
     config_files = [f.path for f in os.scandir(list_backups()[idx]) if f.is_file()]
+    # db file is overwritten, connection can not survive
+    connection.close()
     for f in config_files:
         shutil.copy2(f, conf.CONFIG_PATH)
     msg.msg(f"Backup files restored: {config_files}")
@@ -106,6 +113,12 @@ def int_to_date_log(logi_date: int) -> str:
     return logi_dt.strftime("%Y-%b-%d %H:%M:%S")
 
 
+def ser_to_date_log(logi_dates: pd.Series) -> pd.Series:
+    """vectorized int_to_date_log() for whole column"""
+    logi_dt = pd.to_datetime(logi_dates.astype("int64"), unit="s", utc=True)
+    return logi_dt.dt.tz_convert(tz.tzlocal()).dt.strftime("%Y-%b-%d %H:%M:%S")
+
+
 def str_to_date_backup(date: str) -> datetime:
     """convert string date to datetime object
     date in formt path/.config/backup_%Y-%b-%d-%h%M%s%f"""
@@ -221,6 +234,148 @@ def read_json_list(file: str) -> Dict[str, list[str]]:
     return data
 
 
+class SqlScheme:
+    """
+    sql_scheme.jsonc parsed once (see read_scheme())
+    column sets derived for table are computed on first use and kept
+    """
+
+    def __init__(self, file: str) -> None:
+        self.scheme = read_json_dict(file)
+        self.tabs = list(self.scheme.keys())
+        self.__derived__: Dict[tuple, Any] = {}
+
+    def __memo__(self, key: tuple, derive: Callable[[], Any]) -> Any:
+        """derive value only once"""
+        if key not in self.__derived__:
+            self.__derived__[key] = derive()
+        return self.__derived__[key]
+
+    def hash_cols(self, tab: str) -> list[str]:
+        """HASH_COLS of tab"""
+        return list(self.scheme[tab].get("HASH_COLS", []))
+
+    def unique_cols(self, tab: str) -> list[str]:
+        """UNIQUE columns of tab"""
+        return list(self.scheme[tab].get("UNIQUE", []))
+
+    def foreign(self, tab: str) -> list[tuple[str, str, str]]:
+        """FOREIGN keys of tab unpacked to (col, foreign_tab, foreign_col)"""
+        return self.__memo__(
+            ("foreign", tab),
+            lambda: [unpack_foreign(f) for f in self.scheme[tab].get("FOREIGN", [])],
+        )
+
+    def col_description(self) -> dict[str, str]:
+        """COL_DESCRIPTION of all tables, first description wins"""
+
+        def derive() -> dict[str, str]:
+            col_desc = {}
+            for _, cont in self.scheme.items():
+                for k, v in cont.get("COL_DESCRIPTION", {}).items():
+                    if k not in col_desc:
+                        col_desc[k] = v
+            return col_desc
+
+        return dict(self.__memo__(("col_description",), derive))
+
+    def all_cols(self) -> set[str]:
+        """columns of all tables"""
+        return set(
+            self.__memo__(
+                ("all_cols",),
+                lambda: {
+                    c
+                    for cont in self.scheme.values()
+                    for c in cont.keys()
+                    if c not in conf.SQL_KEYWORDS
+                },
+            )
+        )
+
+    def tab_cols(
+        self, tab: str, all_cols: bool = False, foreign: bool = True
+    ) -> tuple[list[str], list[str]]:
+        """see common.tab_cols()"""
+        must_cols, nice_cols = self.__memo__(
+            ("tab_cols", tab, all_cols, foreign),
+            lambda: self.__tab_cols__(tab, all_cols, foreign),
+        )
+        return (list(must_cols), list(nice_cols))
+
+    def __tab_cols__(
+        self, tab: str, all_cols: bool, foreign: bool
+    ) -> tuple[list[str], list[str]]:
+        """compute must and nice columns of tab"""
+        sql_scheme = self.scheme
+        cols = list(sql_scheme.get(tab, ""))
+        must_cols = [
+            c
+            for c in cols
+            if any(cc in sql_scheme[tab][c] for cc in ["NOT NULL", "PRIMARY KEY"])
+        ]
+        nice_cols = [c for c in cols if "NOT NULL" not in sql_scheme[tab][c]]
+        nice_cols = [c for c in nice_cols if "PRIMARY KEY" not in sql_scheme[tab][c]]
+
+        if "UNIQUE" in cols:
+            for u in sql_scheme[tab]["UNIQUE"]:
+                must_cols += [u]
+                if u in nice_cols:
+                    nice_cols.remove(u)
+
+        if "FOREIGN" in cols and foreign:
+            for col, foreign_tab, _ in self.foreign(tab):
+                nice_cols = [c for c in nice_cols if c not in col]
+                must_cols = [c for c in must_cols if c not in col]
+
+                # get foreign columns
+                if foreign_tab not in sql_scheme:
+                    raise SqlTabError(foreign_tab, sql_scheme.keys())
+                (
+                    foreign_must,
+                    foreign_nice,
+                ) = self.tab_cols(foreign_tab)
+                must_cols += foreign_must
+                nice_cols += foreign_nice
+
+        # remove duplicates
+        must_cols = list(set(must_cols))
+        nice_cols = list(set(nice_cols))
+        if not all_cols:
+            # remove COMMANDS which are filled automatically
+            nice_cols = [
+                c for c in nice_cols if c not in conf.SQL_KEYWORDS + conf.HIDDEN_COLS
+            ]
+            must_cols = [c for c in must_cols if c not in conf.HIDDEN_COLS]
+        else:
+            nice_cols = [c for c in nice_cols if c not in conf.SQL_KEYWORDS]
+            if "id" in must_cols:
+                must_cols.remove("id")
+        return (must_cols, nice_cols)
+
+
+# parsed sql_scheme, keyed on file location and modification time
+scheme_cache: Dict[tuple, SqlScheme] = {}
+
+
+def read_scheme() -> SqlScheme:
+    """
+    return parsed conf.SQL_SCHEME
+    file is parsed again only when changed
+    raise read_jsonError if format is wrong or file do not exists
+    """
+    try:
+        stat = os.stat(conf.SQL_SCHEME)
+    except OSError as err:
+        raise ReadJsonError(str(conf.SQL_SCHEME)) from err
+    key = (str(conf.SQL_SCHEME), stat.st_mtime_ns, stat.st_size)
+    if key not in scheme_cache:
+        scheme = SqlScheme(conf.SQL_SCHEME)
+        scheme_cache.clear()
+        scheme_cache[key] = scheme
+    return scheme_cache[key]
+
+
 def find_files(directory: str, file_format: str) -> list:
     """
     scan all subdirectories (starting from 'directory')
@@ -283,8 +438,7 @@ def tab_in_scheme() -> List:
     raises:
         read_jsonError
     """
-    sql_scheme = read_json_dict(conf.SQL_SCHEME)
-    return list(sql_scheme.keys())
+    return list(read_scheme().tabs)
 
 
 def list_to_tuple_str(*args: Union[List, pd.Index], quote=True) -> str:
@@ -312,7 +466,7 @@ def tab_exists_scheme(tab: str) -> None:
         sql_tabError if tab not exists
         read_jsonError
     """
-    sql_scheme = read_json_dict(conf.SQL_SCHEME)
+    sql_scheme = read_scheme().scheme
     if tab not in sql_scheme.keys():
         raise SqlTabError(tab, sql_scheme.keys())
 
@@ -328,64 +482,15 @@ def tab_cols(
     follow FOREIGN key constraints to other tab if foreign==True
     if all_cols==True, show also hidden cols
     """
-    sql_scheme = read_json_dict(conf.SQL_SCHEME)
     tab_exists_scheme(tab)  # will raise sql_tabError if not
-
-    cols = list(sql_scheme.get(tab, ""))
-    must_cols = [
-        c
-        for c in cols
-        if any(cc in sql_scheme[tab][c] for cc in ["NOT NULL", "PRIMARY KEY"])
-    ]
-    nice_cols = [c for c in cols if "NOT NULL" not in sql_scheme[tab][c]]
-    nice_cols = [c for c in nice_cols if "PRIMARY KEY" not in sql_scheme[tab][c]]
-
-    if "UNIQUE" in cols:
-        for u in sql_scheme[tab]["UNIQUE"]:
-            must_cols += [u]
-            if u in nice_cols:
-                nice_cols.remove(u)
-
-    if "FOREIGN" in cols and foreign:
-        for f in sql_scheme[tab]["FOREIGN"]:
-            col, foreign_tab, _ = unpack_foreign(f)
-
-            nice_cols = [c for c in nice_cols if c not in col]
-            must_cols = [c for c in must_cols if c not in col]
-
-            # get foreign columns
-            (
-                foreign_must,
-                foreign_nice,
-            ) = tab_cols(foreign_tab)
-            must_cols += foreign_must
-            nice_cols += foreign_nice
-
-    # remove duplicates
-    must_cols = list(set(must_cols))
-    nice_cols = list(set(nice_cols))
-    if not all_cols:
-        # remove COMMANDS which are filled automatically
-        nice_cols = [
-            c for c in nice_cols if c not in conf.SQL_KEYWORDS + conf.HIDDEN_COLS
-        ]
-        must_cols = [c for c in must_cols if c not in conf.HIDDEN_COLS]
-    else:
-        nice_cols = [c for c in nice_cols if c not in conf.SQL_KEYWORDS]
-        if "id" in must_cols:
-            must_cols.remove("id")
-    return (must_cols, nice_cols)
+    must_cols, nice_cols = read_scheme().tab_cols(tab, all_cols, foreign)
+    return (list(must_cols), list(nice_cols))
 
 
 def foreign_tabs(tab: str) -> list[str]:
     """return list of tables referenced in FOREIGN key"""
     tab_exists_scheme(tab)  # will raise sql_tabError if not
-    sql_scheme = read_json_dict(conf.SQL_SCHEME)
-    tabs = []
-    for k in sql_scheme[tab].get("FOREIGN", []):
-        _, f_tab, _ = unpack_foreign(k)
-        tabs += [f_tab]
-    return tabs
+    return [f_tab for _, f_tab, _ in read_scheme().foreign(tab)]
 
 
 def refernce_foreign(tab: str) -> Tuple[set[str], List[str]]:
@@ -394,14 +499,12 @@ def refernce_foreign(tab: str) -> Tuple[set[str], List[str]]:
     foreign keys and foreign key itself for reporting purposes
     """
     tab_exists_scheme(tab)  # will raise sql_tabError if not
-    sql_scheme = read_json_dict(conf.SQL_SCHEME)
-    tabs = tab_in_scheme()
-    tabs = [t for t in tabs if t != tab]
+    scheme = read_scheme()
+    tabs = [t for t in scheme.tabs if t != tab]
     ref_cols = []
     ref_f = []
     for t in tabs:
-        for f in sql_scheme[t].get("FOREIGN", {}):
-            ref_col, ref_tab, ref_tab_col = unpack_foreign(f)
+        for ref_col, ref_tab, ref_tab_col in scheme.foreign(t):
             if ref_tab == tab:
                 ref_cols.append(ref_tab_col)
                 ref_f.append(
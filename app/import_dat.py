@@ -3,22 +3,33 @@ import/export tools for tables (BOM,SHOP,STOCK)
 also commits
 """
 
+import itertools
 import os
 import sys
+import zipfile
 from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator
 
+import openpyxl
 import pandas as pd
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.core.dtypes.cast import find_common_type
 from pandas.errors import EmptyDataError, ParserError
 
 import conf.config as conf
 from app import sql
+from app.common import read_scheme
 from app.message import msg
+from app.sql_connection import connection
 from app.tabs import (
-    import_tab,
+    ImportSession,
+    parse_tab,
     prepare_project,
     scan_files,
     tab_info,
     tab_template,
+    write_tab,
 )
 
 
@@ -39,17 +50,7 @@ def stock_import(args: Namespace) -> None:
     if args.export or args.fzf:
         export(args, "STOCK")
         return
-    files = scan_files(args)
-    for file in files:
-        new_stock = import_file(args, file)
-        if new_stock.empty:
-            continue
-        import_tab(
-            dat=new_stock,
-            tab="STOCK",
-            args=args,
-            file=file,
-        )
+    import_files(args, "STOCK")
 
 
 def shop_import(args: Namespace) -> None:
@@ -64,17 +65,7 @@ def shop_import(args: Namespace) -> None:
         export(args, "SHOP")
         return
 
-    files = scan_files(args)
-    for file in files:
-        new_stock = import_file(args, file)
-        if new_stock.empty:
-            continue
-        import_tab(
-            dat=new_stock,
-            tab="SHOP",
-            args=args,
-            file=file,
-        )
+    import_files(args, "SHOP")
 
 
 def bom_import(args: Namespace) -> None:
@@ -91,38 +82,130 @@ def bom_import(args: Namespace) -> None:
         export(args, "BOM")
         return
 
+    import_files(args, "BOM")
+
+
+def import_files(args: Namespace, tab: str) -> None:
+    """
+    import all scanned files into tab
+    files are read and prepared in parallel (up to conf.IMPORT_WORKERS processes),
+    then aligned one by one in files order (asking user) and written at once
+    in one transaction (see ImportSession)
+    big xlsx files are read, aligned and written chunk by chunk
+    (transaction per chunk), so memory is bounded
+    """
     files = scan_files(args)
-    for file in files:
-        new_stock = import_file(args, file)
-        if new_stock.empty:
-            continue
-        import_tab(
-            dat=new_stock,
-            tab="BOM",
-            args=args,
-            file=file,
+    streamed = [f for f in files if stream_file(args, f)]
+    parse_files = [f for f in files if f not in streamed]
+    workers = min(conf.IMPORT_WORKERS, len(parse_files))
+    if workers > 1:
+        # 'func' is not needed for parsing
+        args_parse = Namespace(
+            **{k: v for k, v in vars(args).items() if not callable(v)}
         )
+        config = {
+            k: v for k, v in vars(conf).items() if k.isupper() or k == "import_format"
+        }
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(config,)
+        ) as pool:
+            parsed = pool.map(
+                parse_file,
+                itertools.repeat(args_parse),
+                parse_files,
+                itertools.repeat(tab),
+            )
+            parsed = dict(zip(parse_files, parsed))
+    else:
+        parsed = {file: parse_file(args, file, tab) for file in parse_files}
+    session = ImportSession(tab=tab, args=args)
+    for file in files:
+        if file in streamed:
+            # previous files first, keep files order
+            session.commit()
+            for i, chunk in enumerate(parse_file(args, file, tab) or []):
+                if not write_tab(
+                    dat=chunk, tab=tab, args=args, session=session, new_file=i == 0
+                ):
+                    break
+                session.commit()
+        elif (dat := parsed[file]) is not None:
+            write_tab(dat=dat, tab=tab, args=args, session=session)
+    session.commit()
+    session.inform()
+
+
+def init_worker(config: Dict[str, Any]) -> None:
+    """
+    initialize process parsing import files
+    db connection inherited from parent (fork) is never used in worker,
+    config is set as in parent (not only as read from toml file, also with spawn)
+    """
+    connection.detach()
+    vars(conf).update(config)
+
+
+def parse_file(
+    args: Namespace, file: str, tab: str
+) -> pd.DataFrame | Iterator[pd.DataFrame] | None:
+    """
+    read and prepare file for import, None if nothing to import
+    iterator of prepared chunks for streamed file
+    """
+    dat = import_file(args, file)
+    if isinstance(dat, pd.DataFrame) and dat.empty:
+        return None
+    return parse_tab(dat=dat, tab=tab, args=args, file=file)
+
+
+def read_args(file_format: str, columns: pd.Index | None = None) -> Dict[str, Any]:
+    """
+    pandas reader args and kwargs from conf.import_format[file_format]
+    when file columns are given, read only columns used later (renamed in 'cols'
+    or present in sql_scheme) and cast 'dtype' while reading
+    formats with formatter function ('func', 'frame_func') are read whole and raw,
+    formatter may need any column
+    """
+    imp_format = conf.import_format[file_format]
+    kwargs = {
+        k: v for k, v in imp_format.items() if k not in conf.IMPORT_FORMAT_SPECIAL_KEYS
+    }
+    if columns is None or imp_format.get("func") or imp_format.get("frame_func"):
+        return kwargs
+    cols = imp_format.get("cols") or {}
+    keep = set(cols) | read_scheme().all_cols()
+    # column names after columns_align()
+    names = {
+        c: cols.get(str(c).lower(), str(c).lower())
+        for c in columns
+        if str(c).lower() in keep
+    }
+    if names and "usecols" not in kwargs:
+        kwargs["usecols"] = list(names.keys())
+    if dtype := imp_format.get("dtype"):
+        kwargs["dtype"] = {c: dtype[n] for c, n in names.items() if n in dtype}
+    return kwargs
 
 
-def import_csv(file: str) -> pd.DataFrame:
+def import_csv(file: str, file_format: str = "csv") -> pd.DataFrame:
     """import csv using format described in config.py"""
     msg.import_file(file)
     try:
-        new_bom = pd.read_csv(
-            file,
-            **{
-                k: v
-                for k, v in conf.import_format["csv"].items()
-                if k not in conf.IMPORT_FORMAT_SPECIAL_KEYS
-            },
-        )
+        # header is parsed first from the same handle, file is read once
+        with open(file, "rb") as f:
+            columns = pd.read_csv(f, nrows=0, **read_args(file_format)).columns
+            f.seek(0)
+            new_bom = pd.read_csv(f, **read_args(file_format, columns))
     except ParserError as err:
         msg.unknown_import(err)
         return pd.DataFrame()
     except EmptyDataError as err:
         msg.unknown_import(err)
         return pd.DataFrame()
-    return new_bom.copy()
+    except ValueError as err:
+        msg.unknown_import(err)
+        return pd.DataFrame()
+    return new_bom
 
 
 def import_xls(file: str, file_format: str) -> pd.DataFrame:
@@ -133,14 +216,10 @@ def import_xls(file: str, file_format: str) -> pd.DataFrame:
     """
     msg.import_file(file)
     try:
-        new_bom = pd.read_excel(
-            file,
-            **{
-                k: v
-                for k, v in conf.import_format[file_format].items()
-                if k not in conf.IMPORT_FORMAT_SPECIAL_KEYS
-            },
-        )
+        # workbook is loaded once, header parsed first
+        with pd.ExcelFile(file) as xls:
+            columns = xls.parse(nrows=0, **read_args(file_format)).columns
+            new_bom = xls.parse(**read_args(file_format, columns))
     except ParserError as e:
         msg.unknown_import(e)
         return pd.DataFrame()
@@ -153,14 +232,144 @@ def import_xls(file: str, file_format: str) -> pd.DataFrame:
     except FileNotFoundError as e:
         msg.unknown_import(e)
         return pd.DataFrame()
-    return new_bom.copy()
+    return new_bom
+
+
+def import_xlsx_stream(
+    file: str, file_format: str
+) -> pd.DataFrame | Iterator[pd.DataFrame]:
+    """
+    stream xlsx with openpyxl in read-only mode, conf.IMPORT_CHUNK_ROWS rows at once
+    cells are converted and rows parsed as with import_xls(),
+    columns type is inferred for whole file first (as read_excel() do),
+    so chunks are typed the same way
+    index of chunks continues, as if whole file was read
+    return empty DataFrame if nothing to import
+    """
+    msg.import_file(file)
+    try:
+        wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        msg.unknown_import(e)
+        return pd.DataFrame()
+    sheet = wb.worksheets[0]
+    header_row = read_args(file_format).get("header", 0)
+    header = next(sheet.iter_rows(min_row=header_row + 1, max_row=header_row + 1), None)
+    if header is None:
+        wb.close()
+        msg.unknown_import(EmptyDataError("No columns to parse from file"))
+        return pd.DataFrame()
+    # name columns as pandas do: unnamed and duplicated
+    columns = []
+    for i, h in enumerate(xlsx_row(header)):
+        name = base = f"Unnamed: {i}" if h == "" else str(h)
+        n = 1
+        while name in columns:
+            name = f"{base}.{n}"
+            n += 1
+        columns.append(name)
+    kwargs = read_args(file_format, pd.Index(columns))
+    kwargs = {k: v for k, v in kwargs.items() if k not in ["header", "sheet_name"]}
+
+    def data_rows() -> Iterator[list]:
+        rows = (xlsx_row(r) for r in sheet.iter_rows(min_row=header_row + 2))
+        # as pandas, skip trailing empty rows
+        empty = 0
+        for row in rows:
+            if not row:
+                empty += 1
+                continue
+            yield from [[]] * empty
+            empty = 0
+            yield row
+
+    def batches() -> Iterator[list]:
+        rows = data_rows()
+        while batch := list(itertools.islice(rows, conf.IMPORT_CHUNK_ROWS)):
+            yield batch
+
+    def parse(batch: list, dtype: Dict[str, Any]) -> pd.DataFrame:
+        width = len(columns)
+        try:
+            return pd.io.parsers.TextParser(
+                [r[:width] + [""] * (width - len(r)) for r in batch],
+                header=None,
+                names=columns,
+                **{**kwargs, "dtype": {**dtype, **kwargs.get("dtype", {})}},
+            ).read()
+        except ValueError as e:
+            wb.close()
+            msg.unknown_import(e)
+            sys.exit(1)
+
+    # first pass: common type of each column in all chunks
+    dtypes: Dict[str, Any] = {}
+    for batch in batches():
+        df = parse(batch, {})
+        dtypes = {
+            c: find_common_type([dtypes[c], t]) if c in dtypes else t
+            for c, t in df.dtypes.items()
+        }
+
+    def chunks() -> Iterator[pd.DataFrame]:
+        row_no = 0
+        # object columns are not converted (i.e. to numbers) in any chunk
+        obj = {c: object for c, t in dtypes.items() if t == object}
+        try:
+            for batch in batches():
+                df = parse(batch, obj).astype(dtypes)
+                df.index = range(row_no, row_no + len(batch))
+                row_no += len(batch)
+                msg.import_progress(row_no)
+                yield df
+        finally:
+            wb.close()
+
+    return chunks()
+
+
+def xlsx_row(row: tuple) -> list:
+    """
+    openpyxl cells converted as pandas.read_excel() do
+    trailing empty cells are removed
+    """
+    converted = []
+    for cell in row:
+        if cell.value is None:
+            converted.append("")
+        elif cell.data_type == TYPE_ERROR:
+            converted.append(float("nan"))
+        elif cell.data_type == TYPE_NUMERIC and int(cell.value) == cell.value:
+            converted.append(int(cell.value))
+        elif cell.data_type == TYPE_NUMERIC:
+            converted.append(float(cell.value))
+        else:
+            converted.append(cell.value)
+    while converted and converted[-1] == "":
+        converted.pop()
+    return converted
+
+
+def stream_file(args: Namespace, file: str) -> bool:
+    """big xlsx files are read (and written) in chunks"""
+    file_ext = conf.import_format[args.format].get("file_ext", "")
+    return (
+        ("xls" in file_ext or "xlsx" in file_ext)
+        and file.lower().endswith(".xlsx")
+        and os.path.getsize(file) > conf.XLSX_STREAM_SIZE
+    )
 
 
-def import_file(args: Namespace, file: str) -> pd.DataFrame:
-    """import files"""
+def import_file(args: Namespace, file: str) -> pd.DataFrame | Iterator[pd.DataFrame]:
+    """
+    import files
+    big xlsx files are read in chunks: iterator of DataFrames is returned
+    """
     file_ext = conf.import_format[args.format].get("file_ext", "")
     if "csv" in file_ext:
-        return import_csv(file)
+        return import_csv(file, args.format)
+    if stream_file(args, file):
+        return import_xlsx_stream(file, args.format)
     if "xls" in file_ext or "xlsx" in file_ext:
         return import_xls(file, args.format)
     msg.msg(
@@ -171,73 +380,61 @@ def import_file(args: Namespace, file: str) -> pd.DataFrame:
 
 def export(args: Namespace, tab: str) -> None:  # pylint: disable=too-many-branches
     """print or export data in BOM table"""
+    # data is read from db in chunks and written to file chunk by chunk
     if tab == "BOM":
         if (projects := prepare_project(args.export)) == []:
             return
-        df = sql.getDF(tab=tab, search=projects, where=[conf.BOM_PROJECT], follow=True)
+        chunks = sql.getDF(
+            tab=tab,
+            search=projects,
+            where=[conf.BOM_PROJECT],
+            follow=True,
+            chunksize=conf.EXPORT_CHUNK_ROWS,
+        )
         cols = conf.BOM_EXPORT_COL
     elif tab == "STOCK":
-        df = sql.getDF(tab=tab, follow=True)
-        if df.empty:
-            msg.msg(f"No data in table {tab}.")
-            sys.exit(0)
+        chunks = sql.getDF(tab=tab, follow=True, chunksize=conf.EXPORT_CHUNK_ROWS)
         # add shop id and projects
         df_shop = sql.getDF(tab="SHOP")
         df_bom = sql.getDF(tab="BOM")
-        if not df_shop.empty:
-            df = pd.merge(
-                left=df,
-                right=df_shop,
-                left_on=conf.DEV_HASH,
-                right_on=conf.SHOP_HASH,
-                suffixes=("", "_drop"),
-                how="left",
-            )
-        if not df_bom.empty:
-            df = pd.merge(
-                left=df,
-                right=df_bom,
-                left_on=conf.DEV_HASH,
-                right_on=conf.BOM_HASH,
-                suffixes=("", "_drop"),
-                how="left",
-            )
-        df.drop(
-            columns=[col for col in df.columns if col.endswith("_drop")], inplace=True
-        )
+        chunks = (stock_merge(df, df_shop, df_bom) for df in chunks)
+        cols = []
+    else:
+        chunks = sql.getDF(tab=tab, follow=True, chunksize=conf.EXPORT_CHUNK_ROWS)
+        cols = []
+    if (df := next(chunks, None)) is None:
+        msg.msg(f"No data in table {tab}.")
+        sys.exit(0 if tab == "STOCK" else 1)
+    # columns never exported
+    df = df.drop(columns=conf.NO_EXPORT_COLS, errors="ignore")
+    if tab == "STOCK":
         cols = [
             c
             for c in conf.STOCK_EXPORT_COL + [conf.SHOP_ID, conf.BOM_PROJECT]
             if c in df.columns
         ]
-    else:
-        df = sql.getDF(tab=tab, follow=True)
-        cols = df.columns
-    if df.empty:
-        msg.msg(f"No data in table {tab}.")
-        sys.exit(1)
-    df.drop(columns=conf.NO_EXPORT_COLS, inplace=True, errors="ignore")
+    elif tab != "BOM":
+        cols = df.columns.to_list()
     if args.export_columns:
-        try:
-            df = df[args.export_columns]
-        except KeyError as e:
-            msg.msg(str(e))
+        if missing := [c for c in args.export_columns if c not in df.columns]:
+            msg.msg(f"{missing} not in columns")
             msg.msg("Here columns info:")
             tab_info(tab)
             sys.exit(1)
-    else:
-        df = df[cols]
+        cols = args.export_columns
+    chunks = (d[cols] for d in itertools.chain([df], chunks))
     if getattr(args, "fzf", False):
         file = conf.TEMP_DIR + "stock_export.csv"
-        df.to_csv(
-            file,
+        write_chunks(
+            chunks,
+            file=file,
             columns=[c for c in cols if c != conf.DEV_DESC] + [conf.DEV_DESC],
             sep="|",
-            index=False,
         )
         print(file)
         return
     if not args.file:
+        df = pd.concat(chunks, ignore_index=True)
 
         def truncate(width):
             return lambda x: str(x)[:width] + (".." if len(str(x)) > width else "")
@@ -254,7 +451,49 @@ def export(args: Namespace, tab: str) -> None:  # pylint: disable=too-many-branc
             )
         )
         return
-    df.to_csv(os.path.join(args.dir, args.file), index=False)
+    write_chunks(chunks, file=os.path.join(args.dir, args.file))
+
+
+def stock_merge(
+    df: pd.DataFrame, df_shop: pd.DataFrame, df_bom: pd.DataFrame
+) -> pd.DataFrame:
+    """add shop id and projects to STOCK data"""
+    if not df_shop.empty:
+        df = pd.merge(
+            left=df,
+            right=df_shop,
+            left_on=conf.DEV_HASH,
+            right_on=conf.SHOP_HASH,
+            suffixes=("", "_drop"),
+            how="left",
+        )
+    if not df_bom.empty:
+        df = pd.merge(
+            left=df,
+            right=df_bom,
+            left_on=conf.DEV_HASH,
+            right_on=conf.BOM_HASH,
+            suffixes=("", "_drop"),
+            how="left",
+        )
+    return df.drop(columns=[col for col in df.columns if col.endswith("_drop")])
+
+
+def write_chunks(
+    chunks: Iterator[pd.DataFrame], file: str, columns=None, sep=","
+) -> None:
+    """write DataFrames to one csv file, header only with first chunk"""
+    header = True
+    for df in chunks:
+        df.to_csv(
+            file,
+            columns=columns,
+            sep=sep,
+            index=False,
+            header=header,
+            mode="w" if header else "a",
+        )
+        header = False
 
 
 def add_stock(args: Namespace) -> None:
@@ -274,7 +513,7 @@ def add_stock(args: Namespace) -> None:
             msg.msg("No devices in database")
             sys.exit(1)
     else:
-        dat = sql.getDF("DEVICE", follow=True)
+        dat = stock_devices(args.add_device_id, args.add_device_manufacturer)
     if args.add_device_id:
         dat = dat.loc[dat[conf.DEV_ID] == args.add_device_id, :]
         dat["use_qty"] = 1
@@ -288,31 +527,8 @@ def add_stock(args: Namespace) -> None:
             no_devs=True,
         )
         return
-    # collect stock
-    # add 'empty' devices that we want to use
-    # other way we have problem with adding to missing devs in stock
-    zero_stock = dat.copy(deep=True)
-    zero_stock[conf.STOCK_QTY] = 0
-    zero_stock[conf.STOCK_HASH] = zero_stock[conf.DEV_HASH]
-    sql.put(zero_stock, "STOCK", on_conflict={"action": "IGNORE"})
-    stock = sql.getDF(tab="STOCK")
-    # merge and add
-    dat = pd.merge(
-        left=dat,
-        left_on=conf.DEV_HASH,
-        right=stock,
-        right_on=conf.STOCK_HASH,
-        how="left",
-    )
-
-    dat[conf.STOCK_QTY] = dat[conf.STOCK_QTY] + dat["use_qty"]
-    sql.edit(
-        tab="STOCK",
-        new_val=dat[conf.STOCK_QTY].to_list(),
-        col=conf.STOCK_QTY,
-        search=dat[conf.DEV_HASH].to_list(),
-        where=conf.STOCK_HASH,
-    )
+    # STOCK ON_CONFLICT adds stock_qty to existing, new devices are inserted
+    sql.put(stock_delta(dat), "STOCK")
     msg.stock_add(
         project=projects,
         dev_id=args.add_device_id,
@@ -320,6 +536,27 @@ def add_stock(args: Namespace) -> None:
     )
 
 
+def stock_devices(dev_id: str | None, dev_man: str | None) -> pd.DataFrame:
+    """read from DEVICE only devices matching dev_id or dev_man"""
+    if dev_id:
+        return sql.getDF("DEVICE", search=[dev_id], where=[conf.DEV_ID])
+    if dev_man:
+        return sql.getDF("DEVICE", search=[dev_man], where=[conf.DEV_MAN])
+    return sql.getDF("DEVICE")
+
+
+def stock_delta(dat: pd.DataFrame) -> pd.DataFrame:
+    """
+    sum 'use_qty' per device (the same device may be in many projects)
+    return as STOCK table rows
+    """
+    return (
+        dat.groupby(conf.DEV_HASH, as_index=False)["use_qty"]
+        .sum()
+        .rename(columns={conf.DEV_HASH: conf.STOCK_HASH, "use_qty": conf.STOCK_QTY})
+    )
+
+
 def use_stock(args: Namespace) -> None:
     """
     remove devices from stock
@@ -338,7 +575,7 @@ def use_stock(args: Namespace) -> None:
         )
         dat["use_qty"] = dat[conf.BOM_QTY] * args.qty
     else:
-        dat = sql.getDF("DEVICE")
+        dat = stock_devices(args.use_device_id, args.use_device_manufacturer)
     if args.use_device_id:
         dat = dat.loc[dat[conf.DEV_ID] == args.use_device_id, :]
         dat["use_qty"] = 1
@@ -352,23 +589,33 @@ def use_stock(args: Namespace) -> None:
             no_devs=True,
         )
         return
-    # collect stock
-    stock = sql.getDF(tab="STOCK")
-    if stock.empty:
+    # collect stock only for used devices
+    use = stock_delta(dat)
+    use[conf.STOCK_QTY] = -use[conf.STOCK_QTY]
+    stock = sql.getDF(
+        tab="STOCK",
+        get_col=[conf.STOCK_HASH, conf.STOCK_QTY],
+        search=use[conf.STOCK_HASH],
+        where=[conf.STOCK_HASH],
+    )
+    if stock.empty and next(sql.getDF(tab="STOCK", chunksize=1), None) is None:
         msg.stock_use(no_stock=True)
         return
-    # merge and substract
-    dat = pd.merge(
-        left=dat,
-        left_on=conf.DEV_HASH,
+    # do we have enough stock?
+    if stock.empty:
+        stock = pd.DataFrame(columns=[conf.STOCK_HASH, conf.STOCK_QTY])
+    left = pd.merge(
+        left=use,
         right=stock,
-        right_on=conf.STOCK_HASH,
+        on=conf.STOCK_HASH,
         how="left",
+        suffixes=("_use", ""),
     )
-    dat[conf.STOCK_QTY] = dat[conf.STOCK_QTY] - dat["use_qty"]
-    # do we have enough stock?
-    dat_missing = dat.loc[(dat[conf.STOCK_QTY] < 0) | (dat[conf.STOCK_QTY].isna()), :]
-    if not dat_missing.empty:
+    # what left after use
+    left[conf.STOCK_QTY] = left[conf.STOCK_QTY] + left[conf.STOCK_QTY + "_use"]
+    missing = left.loc[(left[conf.STOCK_QTY] < 0) | (left[conf.STOCK_QTY].isna()), :]
+    if not missing.empty:
+        dat_missing = dat.loc[dat[conf.DEV_HASH].isin(missing[conf.STOCK_HASH]), :]
         if conf.BOM_PROJECT in dat_missing.columns:
             missing_proj = dat_missing[conf.BOM_PROJECT].unique()
         else:
@@ -380,24 +627,13 @@ def use_stock(args: Namespace) -> None:
             not_enough=True,
         )
         return
-    # remove what zeroed
-    stock_end = dat.loc[dat[conf.STOCK_QTY] == 0, :]
-    if not stock_end.empty:
-        sql.rm(tab="STOCK", value=stock_end[conf.DEV_HASH], column=[conf.STOCK_HASH])
-        msg.stock_use(
-            project=projects,
-            dev_id=args.use_device_id,
-            dev_man=args.use_device_manufacturer,
-        )
-        return
-    new_stock = dat.loc[dat[conf.STOCK_QTY] > 0, :]
-    sql.edit(
-        tab="STOCK",
-        new_val=new_stock[conf.STOCK_QTY].to_list(),
-        col=conf.STOCK_QTY,
-        search=new_stock[conf.DEV_HASH].to_list(),
-        where=conf.STOCK_HASH,
-    )
+    with sql.transaction():
+        # STOCK ON_CONFLICT adds (negative) stock_qty to existing
+        sql.put(use, "STOCK")
+        # remove what zeroed
+        stock_end = left.loc[left[conf.STOCK_QTY] == 0, conf.STOCK_HASH]
+        if not stock_end.empty:
+            sql.rm(tab="STOCK", value=stock_end, column=[conf.STOCK_HASH])
     msg.stock_use(
         project=projects,
         dev_id=args.use_device_id,
@@ -17,7 +17,7 @@ import pandas as pd
 
 import conf.config as conf
 from app import sql
-from app.common import int_to_date_log
+from app.common import ser_to_date_log
 from app.message import msg
 
 
@@ -59,21 +59,17 @@ class Log:
         split dates from commands and return as tuple
         """
         try:
-            logs = sql.getDF(tab="LOG")
+            # LOG.date is UNIQUE, so indexed: only last n rows are read
+            logs = sql.getDF_last(tab="LOG", order_by=conf.LOG_DATE, n=n)
             if logs.empty:
                 return logs
         except (sql.SqlGetError, sql.SqlExecuteError) as e:
             msg.msg(str(e))
             sys.exit(1)
-        n = min(n, len(logs))
-        logs = logs.loc[len(logs) - n : len(logs), :]
-        # reverse index so easier to select
-        logs.sort_values(by=conf.LOG_DATE, inplace=True, ascending=False)
-        logs.reset_index(inplace=True, drop=True)
-        logs.sort_values(by=conf.LOG_DATE, inplace=True)
-        logs.reset_index(inplace=True)
-        logs["id"] = logs["index"].apply(lambda x: x + 1)
-        logs["date_fmt"] = logs["date"].apply(int_to_date_log)
+        # oldest first, numbered from last command
+        logs["index"] = range(len(logs) - 1, -1, -1)
+        logs["id"] = logs["index"] + 1
+        logs["date_fmt"] = ser_to_date_log(logs[conf.LOG_DATE])
         return logs
 
     def log_write(self, force=False) -> None:
@@ -94,6 +90,10 @@ class Log:
                     index=[1],  # pyright: ignore
                 ),
             )
+            # keep history bounded, as set by LOG_KEEP and LOG_KEEP_DAYS
+            sql.prune_log(vacuum=False)
+            # snapshot before command changes anything
+            sql.checkpoint(now)
         except (sql.SqlExecuteError, sql.SqlTabError) as e:
             msg.msg(str(e))
             sys.exit(1)
@@ -31,6 +31,11 @@ class MessageHandler:  # pylint: disable=too-many-public-methods
         self.message.append(f"Importing file: {os.path.basename(file)}")
         self.__exec__()
 
+    def import_progress(self, rows: int) -> None:
+        """message method"""
+        self.message.append(f"read {rows} rows...")
+        self.__exec__()
+
     def reimport_missing_file(self) -> None:
         """message method"""
         self.message.append("No not-commited projects to reimport")
@@ -247,6 +252,15 @@ class MessageHandler:  # pylint: disable=too-many-public-methods
         self.message.append("Upgraded sql DB.")
         self.__exec__()
 
+    def prune_log(self, removed: dict[str, int]) -> None:
+        """info after removing old history"""
+        self.message.append(
+            f"Removed {removed['log']} commands from log "
+            + f"and {removed['changefeed']} changes from history."
+        )
+        self.message.append(f"Reclaimed {removed['bytes'] / 1024:.0f} kB.")
+        self.__exec__()
+
     def msg(self, message: str) -> None:
         """message method"""
         self.message.append(message)
@@ -319,10 +333,37 @@ class MessageHandler:  # pylint: disable=too-many-public-methods
                 sys.exit(1)
         return len(backups) - idi
 
-    def select_log(self, logs: pd.DataFrame) -> int:
-        """ask user to select logs to undo"""
-        self.message.append("Will undo from selection to last command")
-        self.message.append("Select command to start undo from:")
+    def select_checkpoint(self, dates: list[str]) -> int:
+        """ask user to select checkpoint, return index in dates"""
+        self.message.append("Will restore state from before selected command")
+        self.message.append("Select checkpoint 'id' to restore:")
+        self.message.append("id    |   date")
+        for i, d in enumerate(dates):
+            self.message.append(str(i + 1) + "     |   " + d)
+        self.__exec__()
+        while True:
+            try:
+                idx = input("select checkpoint id (ctr-C to cancel): ")
+                idi = int(idx)
+                if idi > len(dates) or idi < 1:
+                    raise ValueError
+                break
+            except ValueError:
+                print(f"Must be a number in range 1..{len(dates)}")
+                continue
+            except KeyboardInterrupt:
+                print("\nAborted...")
+                sys.exit(1)
+        return idi - 1
+
+    def select_log(self, logs: pd.DataFrame, state: bool = False) -> int:
+        """ask user to select logs to undo (or to show state before)"""
+        if state:
+            self.message.append("Will show table as before selected command")
+            self.message.append("Select command:")
+        else:
+            self.message.append("Will undo from selection to last command")
+            self.message.append("Select command to start undo from:")
         self.message.append(logs.loc[:, ["id", conf.LOG_ARGS, "date_fmt"]])
         self.__exec__()
         while True:
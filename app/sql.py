@@ -6,14 +6,16 @@ DB structure is described in ./conf/sql_scheme.json
 import json
 import os
 import sys
-from typing import Dict, Iterator, List, Set, cast
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Set
 
 import pandas as pd
 
 import conf.config as conf
 from app import sql_core as sql
 from app.common import (
-    TypedItertuple,
     norm_to_list_str,
     tab_exists_scheme,
     tab_in_scheme,
@@ -37,6 +39,8 @@ def sql_upgrade(force=False) -> None:
     add manufacturers table and try to import from manufacturer_alternatives.json
     add LOG table
     add UNIQUE key to STOCK table
+    add INDEX from sql_scheme
+    add CHECKPOINT table
     """
     missing_tabs = [
         t
@@ -44,6 +48,7 @@ def sql_upgrade(force=False) -> None:
             "MANUFACTURER",
             "ALTERNATIVE_MANUFACTURER",
             "LOG",
+            "CHECKPOINT",
         ]
         if t not in sql.__list_tables__()
     ]
@@ -60,7 +65,14 @@ def sql_upgrade(force=False) -> None:
     if not sql.__sqlite_master__(name="uniqueRow_STOCK"):
         defer_tabs.append("STOCK")
 
-    if not missing_tabs and not defer_tabs and not audit_tab:
+    # secondary indexes added to sql_scheme
+    index_tabs = [
+        t
+        for t in tab_in_scheme()
+        if t in sql.__list_tables__() and sql.__missing_index__(t)
+    ]
+
+    if not missing_tabs and not defer_tabs and not audit_tab and not index_tabs:
         msg.msg("sql DB already in latest version")
         sys.exit(1)
     for t in defer_tabs:
@@ -74,80 +86,362 @@ def sql_upgrade(force=False) -> None:
             raise KeyError from e
     for t in missing_tabs:
         sql.__create__(t)
+    # also recreate indexes dropped together with old tables in defer_foreign()
+    sql.__add_index__()
 
     # copying tables (inside defer_tables())is not preserving triggers
     # anyway better to rebuild all
     for t in [
         t
         for t in sql.sql_scheme.keys()
-        if t not in conf.SQL_KEYWORDS and t in sql.__list_tables__()
+        if t not in conf.SQL_KEYWORDS
+        and t not in conf.NO_AUDIT_TABS
+        and t in sql.__list_tables__()
     ]:
         sql.__audit__(t)
 
+    sql.__invalidate_schema__()
     msg.sql_upgrade()
 
 
 def undo(from_date: int) -> None:
-    """undo all commands from date"""
+    """undo all commands from date
+    changes are collapsed per row, only state before first change is restored:
+    - row created -> removed (unless still referenced by other table)
+    - row updated or deleted -> old values written back
+    if there is CHECKPOINT after from_date, CHECKPOINT_TABS are restored from it
+    and only changes between from_date and checkpoint are replayed
+    each table is restored with one statement, all in one transaction
+    """
+    checkpoint = checkpoint_after(from_date)
     logs = getDF(
         tab="audite_changefeed",
         search=[from_date],
         where=["time"],
         oper=">=",
     )
-    # undo starting from last command
-    logs.sort_index(ascending=False, inplace=True)
+    if logs.empty and not checkpoint:
+        return
+    if not logs.empty:
+        logs = expand_batch_audit(logs)
+    if checkpoint and not logs.empty:
+        # changes after checkpoint are covered by snapshot
+        # changes in the same second may be from earlier command, so replayed
+        logs = logs.loc[
+            ~(logs["source"].isin(conf.CHECKPOINT_TABS) & (logs["time"] > checkpoint)),
+            :,
+        ]
+    if not logs.empty:
+        # first change of each row decides what to restore
+        logs = logs.sort_values(by="id", kind="stable").drop_duplicates(
+            subset=["source", "subject"], keep="first"
+        )
+        created = logs["type"].str.endswith(".created")
+        # parents first when writing, children first when removing
+        tabs = [t for t in tab_in_scheme() if t in logs["source"].to_list()]
+    else:
+        created = pd.Series(dtype=bool)
+        tabs = []
     # do not log now
     log_on = log.log_on
     log.log_on = False
-    # trick for pyright to understand pandas itertuples
-    rows = cast(
-        Iterator[TypedItertuple],
-        logs.itertuples(index=False, name="TypedItertuple"),
+    try:
+        with transaction():
+            if checkpoint:
+                restore_checkpoint(checkpoint)
+            for t in tabs:
+                old = [
+                    json.loads(d)["old"]
+                    for d in logs.loc[(logs["source"] == t) & ~created, "data"]
+                ]
+                if old:
+                    put(dat=pd.DataFrame(old), tab=t, on_conflict={"action": "REPLACE"})
+            for t in reversed(tabs):
+                new = logs.loc[(logs["source"] == t) & created, "subject"]
+                if not new.empty:
+                    col_defs = sql.__table_definition__(t)
+                    pk = [c for c in col_defs.keys() if "PRIMARY" in col_defs[c]][0]
+                    # DEVICE tables are replaced when adding new devices
+                    # to allow columns alignment. This triggers DEVICE.created audit.
+                    # Removing may violate FOREIGN KEY constraint
+                    sql.__rm_unreferenced__(tab=t, col=pk, value=new.to_list())
+            # later snapshots describe undone history
+            sql.__cmd_execute__(
+                [f"DELETE FROM CHECKPOINT WHERE {conf.CHECKPOINT_DATE} >= ?"],
+                [str(from_date)],
+            )
+    except SqlExecuteError as e:
+        msg.msg(str(e))
+    finally:
+        log.log_on = log_on
+
+
+def checkpoint(date: int | str, force: bool = False) -> bool:
+    """
+    store snapshot of CHECKPOINT_TABS as state before command at LOG date
+    taken when CHECKPOINT_FREQ commands were logged since last checkpoint
+    (or always when force)
+    only last CHECKPOINT_KEEP checkpoints are kept
+    return True if checkpoint was taken
+    raises:
+        SqlExecuteError
+    """
+    if not force:
+        if not conf.CHECKPOINT_FREQ:
+            return False
+        cmd = [
+            f"SELECT count(*) AS n FROM LOG WHERE {conf.LOG_DATE} > "
+            + f"(SELECT coalesce(max({conf.CHECKPOINT_DATE}), 0) FROM CHECKPOINT)"
+        ]
+        if int(sql.__cmd_execute__(cmd)[cmd[0]].loc[0, "n"]) < conf.CHECKPOINT_FREQ:
+            return False
+    snap = []
+    for t in conf.CHECKPOINT_TABS:
+        dat = getDF_raw(tab=t)
+        data = {"columns": list(dat.columns), "data": sql.__json_rows__(dat)}
+        snap.append(
+            {
+                conf.CHECKPOINT_DATE: int(date),
+                conf.CHECKPOINT_TAB: t,
+                conf.CHECKPOINT_DATA: zlib.compress(json.dumps(data).encode()),
+            }
+        )
+    put(dat=pd.DataFrame(snap), tab="CHECKPOINT")
+    cmd = [
+        f"DELETE FROM CHECKPOINT WHERE {conf.CHECKPOINT_DATE} NOT IN "
+        + f"(SELECT DISTINCT {conf.CHECKPOINT_DATE} FROM CHECKPOINT "
+        + f"ORDER BY {conf.CHECKPOINT_DATE} DESC LIMIT {max(conf.CHECKPOINT_KEEP, 1)})"
+    ]
+    sql.__cmd_execute__(cmd)
+    return True
+
+
+def checkpoint_list() -> pd.DataFrame:
+    """list dates of checkpoints, newest first"""
+    cmd = [
+        f"SELECT DISTINCT {conf.CHECKPOINT_DATE} FROM CHECKPOINT "
+        + f"ORDER BY {conf.CHECKPOINT_DATE} DESC"
+    ]
+    return sql.__cmd_execute__(cmd)[cmd[0]]
+
+
+def checkpoint_after(date: int | str) -> int:
+    """date of first checkpoint at or after date, 0 if none"""
+    cmd = [
+        f"SELECT min({conf.CHECKPOINT_DATE}) AS d FROM CHECKPOINT "
+        + f"WHERE {conf.CHECKPOINT_DATE} >= ?"
+    ]
+    d = sql.__cmd_execute__(cmd, [str(date)])[cmd[0]].loc[0, "d"]
+    return 0 if pd.isna(d) else int(d)
+
+
+def checkpoint_read(date: int | str, tab: str) -> pd.DataFrame:
+    """read table snapshot from CHECKPOINT"""
+    cmd = [
+        f"SELECT {conf.CHECKPOINT_DATA} FROM CHECKPOINT "
+        + f"WHERE {conf.CHECKPOINT_DATE} = ? AND {conf.CHECKPOINT_TAB} = ?"
+    ]
+    resp = sql.__cmd_execute__(cmd, [str(date), tab])[cmd[0]]
+    if resp.empty:
+        raise SqlGetError(f"no checkpoint of table {tab} at {date}")
+    snap = json.loads(zlib.decompress(resp.loc[0, conf.CHECKPOINT_DATA]))
+    return pd.DataFrame(snap["data"], columns=snap["columns"])
+
+
+def restore_checkpoint(date: int | str) -> None:
+    """
+    write back CHECKPOINT_TABS as in snapshot
+    only changed rows are written and only extra rows removed
+    raises:
+        SqlExecuteError
+    """
+    snaps = {t: checkpoint_read(date, t) for t in conf.CHECKPOINT_TABS}
+    tabs = [t for t in tab_in_scheme() if t in snaps]
+    gone = {}
+    with transaction():
+        # parents first when writing, children first when removing
+        for t in tabs:
+            cur = getDF_raw(tab=t)
+            snap = snaps[t]
+            col_defs = sql.__table_definition__(t)
+            pk = [c for c in col_defs.keys() if "PRIMARY" in col_defs[c]][0]
+            if cur.empty:
+                gone[t] = (pk, [])
+                changed = snap
+            elif snap.empty:
+                gone[t] = (pk, cur[pk].to_list())
+                changed = snap
+            else:
+                cols = list(snap.columns)
+                # compare values as stored (NaN -> None), dates as text
+                cur_rows = set(map(tuple, sql.__json_rows__(cur[cols])))
+                snap_rows = sql.__json_rows__(snap)
+                changed = snap.loc[[tuple(r) not in cur_rows for r in snap_rows], :]
+                gone[t] = (pk, cur.loc[~cur[pk].isin(snap[pk]), pk].to_list())
+            if not changed.empty:
+                put(dat=changed, tab=t, on_conflict={"action": "REPLACE"})
+        for t in reversed(tabs):
+            pk, values = gone[t]
+            if values:
+                rm(tab=t, value=values, column=[pk])
+
+
+def state_at(tab: str, date: int | str) -> pd.DataFrame:
+    """
+    return content of table as it was before command at date
+    starts from nearest checkpoint (or current table) and
+    takes back only changes between date and checkpoint
+    """
+    end = checkpoint_after(date) if tab in conf.CHECKPOINT_TABS else 0
+    dat = checkpoint_read(end, tab) if end else getDF_raw(tab=tab)
+    logs = getDF(
+        tab="audite_changefeed",
+        search=[date],
+        where=["time"],
+        oper=">=",
     )
-    for r in rows:
-        args = json.loads(r.data)
-        col_defs = sql.__table_definition__(r.source)
-        pks = [c for c in col_defs.keys() if "PRIMARY" in col_defs[c]]
-        if "created" in r.type:
-            try:
-                rm(
-                    tab=r.source,  # type: ignore
-                    value=[r.subject],  # type: ignore
-                    column=pks,
-                )
-            except SqlExecuteError as e:
-                # DEVICE tables are replaced when adding new devices
-                # to allow columns alignment. This triggers DEVICE.created audit.
-                # Removing may violate FOREIGN KEY constraint
-                if "FOREIGN KEY" in str(e):
-                    continue
-                msg.msg(str(e))
-        if "deleted" in r.type:
-            dat = pd.DataFrame(args["old"], index=pd.Series([0]))
-            put(dat=dat, tab=r.source)
-        if "updated" in r.type:
-            changed_cols = [
-                nk for nk, nv in args["new"].items() if nv != args["old"][nk]
-            ]
-            for c in changed_cols:
-                edit(
-                    tab=r.source,
-                    new_val=[args["old"][c]],
-                    col=c,
-                    search=[r.subject],
-                    where=pks[0],
+    if not logs.empty:
+        logs = logs.loc[logs["source"] == tab, :]
+    if logs.empty:
+        return dat
+    logs = expand_batch_audit(logs)
+    if end:
+        # same second as checkpoint may be before snapshot, see undo()
+        logs = logs.loc[logs["time"] <= end, :]
+    logs = logs.sort_values(by="id", kind="stable").drop_duplicates(
+        subset=["subject"], keep="first"
+    )
+    col_defs = sql.__table_definition__(tab)
+    pk = [c for c in col_defs.keys() if "PRIMARY" in col_defs[c]][0]
+    if not dat.empty:
+        dat = dat.loc[~dat[pk].astype(str).isin(logs["subject"]), :]
+    old = [
+        json.loads(d)["old"]
+        for d in logs.loc[~logs["type"].str.endswith(".created"), "data"]
+    ]
+    if old:
+        dat = pd.concat([dat, pd.DataFrame(old)], ignore_index=True)
+    return dat
+
+
+def prune_log(vacuum: bool = True) -> Dict[str, int]:
+    """
+    remove from LOG and audite_changefeed history older then
+    LOG_KEEP last commands and LOG_KEEP_DAYS days (whichever keeps more)
+    together with older CHECKPOINTs
+    undo is not possible for removed history
+    called with each logged command (without vacuum, see log_write())
+    and by admin --prune_log, which also vacuums db file
+    return number of removed rows and bytes reclaimed
+    raises:
+        SqlExecuteError
+    """
+    cutoff = []
+    if conf.LOG_KEEP:
+        # LOG.date is UNIQUE, so indexed: only last LOG_KEEP rows are read
+        dates = getDF_last(tab="LOG", order_by=conf.LOG_DATE, n=conf.LOG_KEEP)
+        if len(dates) == conf.LOG_KEEP:
+            cutoff.append(int(dates[conf.LOG_DATE].astype(int).min()))
+        else:
+            cutoff.append(0)
+    if conf.LOG_KEEP_DAYS:
+        cutoff.append(int(time.time()) - conf.LOG_KEEP_DAYS * 24 * 60 * 60)
+    size = sql.__db_size__() if vacuum else 0
+    changefeed = sql.CHANGEFEED
+    removed = {"log": 0, "changefeed": 0}
+    if cutoff and (date := min(cutoff)):
+        cmd = [f"SELECT coalesce(max(id), 0) AS id FROM {changefeed}"]
+        last_id = int(sql.__cmd_execute__(cmd)[cmd[0]].loc[0, "id"])
+        log_on = log.log_on
+        log.log_on = False
+        try:
+            with transaction():
+                cmd = [
+                    f"SELECT count(*) AS n FROM LOG WHERE {conf.LOG_DATE} < ?",
+                    f"DELETE FROM LOG WHERE {conf.LOG_DATE} < ?",
+                    f"SELECT count(*) AS n FROM {changefeed} WHERE time < ?",
+                    f"DELETE FROM {changefeed} WHERE time < ?",
+                    f"DELETE FROM CHECKPOINT WHERE {conf.CHECKPOINT_DATE} < ?",
+                ]
+                resp = sql.__cmd_execute__(cmd, [str(date)])
+                removed["log"] = int(resp[cmd[0]].loc[0, "n"])
+                removed["changefeed"] = int(resp[cmd[2]].loc[0, "n"])
+                # removing from LOG is audited as well, drop it
+                sql.__cmd_execute__(
+                    [
+                        f"DELETE FROM {changefeed} "
+                        "WHERE id > ? AND source = 'LOG' AND type = 'LOG.deleted'"
+                    ],
+                    [str(last_id)],
                 )
-    log.log_on = log_on
+        finally:
+            log.log_on = log_on
+    if vacuum:
+        sql.__cmd_execute__(["VACUUM"])
+        removed["bytes"] = size - sql.__db_size__()
+    return removed
 
 
-def put(dat: pd.DataFrame, tab: str, on_conflict: dict | None = None) -> Dict:
+def expand_batch_audit(logs: pd.DataFrame) -> pd.DataFrame:
+    """
+    replace '{tab}.batch' records from audite_changefeed (see put(batch_audit=True))
+    with row level records, as written by audite triggers
+    """
+    batch = logs["type"].str.endswith(".batch")
+    if not batch.any():
+        return logs
+    rows = []
+    for r in logs.loc[batch, :].to_dict(orient="records"):
+        data = json.loads(r["data"])
+        for subject in data["created"]:
+            rows.append(r | {"subject": subject, "type": f"{r['source']}.created"})
+        for old in data["old"]:
+            rows.append(
+                r
+                | {
+                    "subject": str(old[data["pk"]]),
+                    "type": f"{r['source']}.updated",
+                    "data": json.dumps({"old": old}),
+                }
+            )
+    return pd.concat([logs.loc[~batch, :], pd.DataFrame(rows)], ignore_index=True)
+
+
+@contextmanager
+def transaction() -> Iterator[None]:
+    """
+    group put/rm/edit calls into one sql transaction:
+        with sql.transaction():
+            put(...)
+            rm(...)
+    all or nothing is written, also on KeyboardInterrupt
+    raises:
+        SqlExecuteError
+    """
+    log_on = log.log_on
+    try:
+        with sql.__transaction__():
+            yield
+    except BaseException:
+        # log was rolled back together with data
+        log.log_on = log_on
+        raise
+
+
+def put(
+    dat: pd.DataFrame,
+    tab: str,
+    on_conflict: dict | None = None,
+    batch_audit: bool = False,
+) -> Dict:
     """
     put DataFrame into sql at table=tab
     takes from DataFrame only columns present in sql table
     check if tab exists!
     If 'on_conflict' is None, use one defined in sql_scheme.json,
     other way take 'action' (so using UPDATE_SET with add_columns not implemented)
+    If 'batch_audit', store one audit record for all rows (for big imports)
+    return {'rows': rows written, 'time': seconds taken} or {} when nothing to write
     raises:
         SqlExecuteError and SqlTabError
     """
@@ -174,6 +468,7 @@ def put(dat: pd.DataFrame, tab: str, on_conflict: dict | None = None) -> Dict:
         dat=d,
         tab=tab,
         on_conflict=on_conflict,  # pyright: ignore
+        batch_audit=batch_audit,
     )
 
 
@@ -243,13 +538,14 @@ def rm_all_tabs(hash_list: list[str]) -> None:
     for t in tabs:
         th, _, _ = unpack_foreign(sql.sql_scheme[t].get("FOREIGN"))
         tab_hash.append(th)
-    for table, hash_col in {
-        "BOM": conf.BOM_HASH,
-        "SHOP": conf.SHOP_HASH,
-        "STOCK": conf.STOCK_HASH,
-        "DEVICE": conf.DEV_HASH,
-    }.items():
-        rm(tab=table, value=hash_list, column=[hash_col])
+    with transaction():
+        for table, hash_col in {
+            "BOM": conf.BOM_HASH,
+            "SHOP": conf.SHOP_HASH,
+            "STOCK": conf.STOCK_HASH,
+            "DEVICE": conf.DEV_HASH,
+        }.items():
+            rm(tab=table, value=hash_list, column=[hash_col])
 
 
 def getDF(  # pylint: disable=R0913,R0917,C0103
@@ -259,7 +555,8 @@ def getDF(  # pylint: disable=R0913,R0917,C0103
     where: List[str] | Set[str] | pd.Series | None = None,
     follow: bool = False,
     oper="IN",
-) -> pd.DataFrame:
+    chunksize: int | None = None,
+) -> Any:
     """wraper around get() when:
     - search is on one col
     returns dataframe, in contrast to Dict[col:pd.DataFrame]
@@ -269,14 +566,24 @@ def getDF(  # pylint: disable=R0913,R0917,C0103
         search: what to get (default '%' for everything)
         where: columns used for searching (default '%' for everything)
         follow: if True, search in all FOREIGN subtables
+        chunksize: if given, return iterator of DataFrames with chunksize rows
+            read from db lazily, consume before next sql command
     Raises:
         SqlExecuteError
         SqlGetError
         SqlGetOperationError
     """
     resp = sql.__get__(
-        tab=tab, get_col=get_col, search=search, where=where, follow=follow, oper=oper
+        tab=tab,
+        get_col=get_col,
+        search=search,
+        where=where,
+        follow=follow,
+        oper=oper,
+        chunksize=chunksize,
     )
+    if chunksize:
+        return list(resp.values())[0] if resp else iter([])
     return list(resp.values())[0] if resp else pd.DataFrame()
 
 
@@ -310,6 +617,33 @@ def getL(  # pylint: disable=R0913,R0917,C0103
     return [] if df.empty else list(df.to_dict(orient="list").values())[0]
 
 
+def getDF_last(  # pylint: disable=invalid-name
+    tab: str, order_by: str, n: int
+) -> pd.DataFrame:
+    """
+    return last n rows of tab by column order_by, in ascending order
+    sorting and limit done by sql, so indexed column is read only partially
+    Raises:
+        SqlExecuteError
+    """
+    cmd = [
+        f"SELECT * FROM (SELECT * FROM {tab} ORDER BY {order_by} DESC "
+        + f"LIMIT {int(n)}) ORDER BY {order_by}"
+    ]
+    return sql.__cmd_execute__(cmd)[cmd[0]]
+
+
+def getDF_raw(tab: str) -> pd.DataFrame:  # pylint: disable=invalid-name
+    """
+    return all rows of tab with values as stored in db (dates as ISO text)
+    for snapshots written back later with put()
+    Raises:
+        SqlExecuteError
+    """
+    cmd = [f"SELECT {sql.__raw_cols__(tab)} FROM {tab}"]
+    return sql.__cmd_execute__(cmd)[cmd[0]]
+
+
 def rm(
     tab: str,
     value: list[str] | pd.Series | None = None,
@@ -329,10 +663,10 @@ def rm(
 
     value = norm_to_list_str(value)
     column = norm_to_list_str(column)
-    for c in column:
-        placeholders = ",".join("?" * len(value))
-        cmd = f"DELETE FROM {tab} WHERE {c} IN ({placeholders})"
-        sql.__cmd_execute__([cmd], value)
+    with sql.__search_keys__(value) as (placeholders, params):
+        for c in column:
+            cmd = f"DELETE FROM {tab} WHERE {c} IN ({placeholders})"
+            sql.__cmd_execute__([cmd], params)
 
 
 def edit(
@@ -342,14 +676,20 @@ def edit(
     search: list[str],
     where: str,
 ) -> None:
-    """Update table in db"""
+    """Update table in db
+    set col to new_val in rows where column 'where' equal to search
+    one prepared statement executed for all rows
+    """
     log.log_write()
-    if len(new_val) != len(search):
+    if len(new_val) != len(search) or not search:
         return
-    cmd = []
-    for nv, s in zip(new_val, search):
-        cmd.append(f"UPDATE {tab} SET {col} = '{nv}' WHERE {where} = '{s}'")
-    sql.__cmd_execute__(cmd)
+    # python values (no numpy types), NA as NULL
+    params = zip(
+        sql.__sql_values__(pd.Series(new_val)),
+        sql.__sql_values__(pd.Series(search)),
+    )
+    cmd = f"UPDATE {tab} SET {col} = ? WHERE {where} = ?"
+    sql.__cmd_execute__([cmd], list(params))
 
 
 def check() -> None:
@@ -383,6 +723,11 @@ def check() -> None:
         # now must be declared explicitly
         if not sql.__sqlite_master__(f"uniqueRow_{tab}") and tab == "STOCK":
             raise SqlCheckError(conf.DB_FILE, tab, unique=True)
+        # INDEX do not change data, so can be just created when missing
+        if sql.__missing_index__(tab):
+            sql.__add_index__(tab=tab)
     # check auditing tables (audite_changefeed)
     if "audite_changefeed" not in sql.__list_tables__():
         raise SqlCheckError(conf.DB_FILE, "audite")
+    if not sql.__sqlite_master__(sql.CHANGEFEED_INDEX):
+        sql.__changefeed_index__()
@@ -0,0 +1,109 @@
+"""
+process-wide sqlite connection
+one connection is opened lazily per DB_FILE and reused by all sql_core functions
+do not import from other files in project (except config.py)
+as this module is used also by common.py
+"""
+
+import atexit
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+import conf.config as conf
+
+
+class SqlConnection:
+    """keep one sqlite connection open for the whole run"""
+
+    def __init__(self) -> None:
+        self.con: sqlite3.Connection | None = None
+        self.db_file = ""
+        # inode of db file, to detect file removed or replaced
+        self.db_ino = 0
+        # increased on each (re)connect, allows to invalidate caches
+        self.generation = 0
+        # nesting level of transaction(), commit only on level 0
+        self.depth = 0
+        # open db with mode=ro (no write locks), set before first sql command
+        self.read_only = False
+        self.con_read_only = False
+        # connections inherited from parent process, never used nor closed
+        self.detached: list[sqlite3.Connection] = []
+
+    def get(self) -> sqlite3.Connection:
+        """
+        return open connection to conf.DB_FILE
+        reconnect if DB_FILE changed or file was removed/replaced
+        """
+        if self.con is not None and not self.__valid__():
+            self.close()
+        if self.con is None:
+            self.__connect__()
+        return self.con  # type: ignore
+
+    def close(self) -> None:
+        """
+        commit and close connection
+        closing last connection checkpoints WAL into db file,
+        so must be called before copying or removing db file
+        """
+        if self.con is None:
+            return
+        try:
+            if self.depth:
+                # never commit half of transaction
+                self.con.rollback()
+            self.con.commit()
+            self.con.close()
+        except sqlite3.Error:  # pylint: disable=E1101
+            pass
+        self.con = None
+        self.depth = 0
+
+    def detach(self) -> None:
+        """
+        forget connection inherited from parent process (fork)
+        closing it in child could checkpoint WAL of db still used by parent,
+        so it is kept open and new connection is opened when needed
+        """
+        if self.con is not None:
+            self.detached.append(self.con)
+        self.con = None
+        self.depth = 0
+
+    def __valid__(self) -> bool:
+        """check if open connection still points to conf.DB_FILE"""
+        if self.db_file != conf.DB_FILE:
+            return False
+        if self.con_read_only != self.read_only:
+            return False
+        try:
+            return os.stat(self.db_file).st_ino == self.db_ino
+        except OSError:
+            return False
+
+    def __connect__(self) -> None:
+        """open connection and apply PRAGMAs once"""
+        db = conf.DB_FILE
+        if self.read_only:
+            db = f"file:{pathname2url(os.path.abspath(db))}?mode=ro"
+        self.con = sqlite3.connect(  # pylint: disable=E1101
+            db,
+            detect_types=sqlite3.PARSE_COLNAMES  # pylint: disable=E1101
+            | sqlite3.PARSE_DECLTYPES,  # pylint: disable=E1101
+            uri=self.read_only,
+        )
+        self.con.execute("PRAGMA foreign_keys = ON")
+        self.con.execute("PRAGMA recursive_triggers = OFF")
+        if not self.read_only:
+            # db stays in WAL once set, so readers do not block writer
+            self.con.execute("PRAGMA journal_mode = WAL")
+        self.con_read_only = self.read_only
+        self.db_file = conf.DB_FILE
+        self.db_ino = os.stat(self.db_file).st_ino
+        self.generation += 1
+
+
+connection = SqlConnection()
+atexit.register(connection.close)
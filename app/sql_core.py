@@ -2,11 +2,16 @@
 not to be used directly, see sql.py for user functions
 """
 
+import copy
+import itertools
+import json
 import os
 import re
 import sqlite3
 import sys
-from typing import Any, Dict, List, Sequence, Set, Union
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Set, Union
 
 import pandas as pd
 from audite import track_changes
@@ -33,6 +38,7 @@ from app.error import (
     SqlTabError,
 )
 from app.message import msg
+from app.sql_connection import connection
 
 try:
     sql_scheme = read_json_dict(conf.SQL_SCHEME)
@@ -40,6 +46,32 @@ except ReadJsonError as err:
     print(err)
     sys.exit(1)
 
+# tables, columns and foreign keys read from db
+# to avoid PRAGMA queries on each get/put
+schema_cache: Dict[Any, Any] = {}
+
+# commands changing db structure, invalidate schema_cache
+# temporary tables are not part of db structure
+# nor triggers, which __batch_audit__() drops and recreates unchanged on each put
+DDL_CMD = re.compile(
+    r"^\s*(CREATE|DROP|ALTER)\b(?!\s+TEMP)(?!\s+TRIGGER)(?!.*\bTEMP\.)",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# max number of '?' params in one sql command
+# longer search lists are loaded into temporary table, see __search_keys__()
+SQL_MAX_PARAMS = 900
+# each bulk load gets own temporary table, see __search_keys__()
+search_keys_id = itertools.count()
+search_keys_free: List[str] = []
+
+# audit table of audite and its index on time, see __changefeed_index__()
+CHANGEFEED = "audite_changefeed"
+CHANGEFEED_INDEX = f"{CHANGEFEED}_time_id_idx"
+
+# rows written by one executemany in __write_table__()
+SQL_WRITE_BATCH = 10_000
+
 
 def __create__(one_tab="") -> None:  # pylint: disable=too-many-branches
     """Creates sql query based on sql_scheme.json and send to db.
@@ -49,6 +81,7 @@ def __create__(one_tab="") -> None:  # pylint: disable=too-many-branches
     if os.path.isfile(conf.DB_FILE) and not one_tab:
         # just in case the file exists
         # when creating only one tab assumption is that we want to add to existing db
+        connection.close()
         os.remove(conf.DB_FILE)
     path = os.path.dirname(conf.DB_FILE)
     if not os.path.isdir(path):
@@ -77,9 +110,12 @@ def __create__(one_tab="") -> None:  # pylint: disable=too-many-branches
         __cmd_execute__(sql_cmd)
         if one_tab:
             __add_unique__(tab=one_tab)
+            __add_index__(tab=one_tab)
         else:
             __add_unique__()
+            __add_index__()
     except SqlExecuteError as err:
+        connection.close()
         os.remove(conf.DB_FILE)
         msg.msg(str(err))
         raise SqlCreateError(conf.SQL_SCHEME) from err
@@ -88,11 +124,16 @@ def __create__(one_tab="") -> None:  # pylint: disable=too-many-branches
     all_tables = __list_tables__()
     if not all(k in all_tables for k in scheme.keys()):
         if os.path.isfile(conf.DB_FILE):
+            connection.close()
             os.remove(conf.DB_FILE)
         raise SqlCreateError(conf.SQL_SCHEME)
     # add auditing all changes on all tables
     for tab in scheme:
-        __audit__(tab=tab)
+        if tab not in conf.NO_AUDIT_TABS:
+            __audit__(tab=tab)
+    __invalidate_schema__()
+    if CHANGEFEED in __list_tables__():
+        __changefeed_index__()
 
 
 def __list_tables__() -> List:
@@ -100,9 +141,13 @@ def __list_tables__() -> List:
     list all tables in sql db
     """
     sql_cmd = ["SELECT tbl_name FROM sqlite_master WHERE type='table'"]
-    try:
+
+    def read() -> List:
         status = __cmd_execute__(sql_cmd)
         return status[sql_cmd[-1][0:100]]["tbl_name"].to_list()
+
+    try:
+        return __schema_cache__(("tables",), read)
     except SqlExecuteError as err:
         msg.msg(str(err))
         return []
@@ -110,11 +155,15 @@ def __list_tables__() -> List:
 
 def __tab_columns__(tab: str) -> set[str]:
     """return list of columns for table"""
-    sql_cmd = f"pragma table_info({tab})"
-    resp = __cmd_execute__([sql_cmd])
-    if not resp or resp[sql_cmd].empty:
-        return set()
-    return set(resp[sql_cmd]["name"].to_list())
+
+    def read() -> set[str]:
+        sql_cmd = f"pragma table_info({tab})"
+        resp = __cmd_execute__([sql_cmd])
+        if not resp or resp[sql_cmd].empty:
+            return set()
+        return set(resp[sql_cmd]["name"].to_list())
+
+    return __schema_cache__(("columns", tab), read)
 
 
 def __sqlite_master__(name: str, pattern: Union[None, str] = None) -> str:
@@ -123,13 +172,17 @@ def __sqlite_master__(name: str, pattern: Union[None, str] = None) -> str:
     name=uniqueRow_{table name} -> uniqe column for table
     match against pattern if given
     """
-    cmd = f"SELECT sql FROM sqlite_schema WHERE name = '{name}'"
-    resp = __cmd_execute__([cmd])
-    resp_df = resp[cmd]
-    if resp_df.empty:
-        return ""
-    resps = str(resp_df.loc[0, "sql"])
-    if pattern is not None:
+
+    def read() -> str:
+        cmd = f"SELECT sql FROM sqlite_schema WHERE name = '{name}'"
+        resp = __cmd_execute__([cmd])
+        resp_df = resp[cmd]
+        if resp_df.empty:
+            return ""
+        return str(resp_df.loc[0, "sql"])
+
+    resps = __schema_cache__(("master", name), read)
+    if resps and pattern is not None:
         if match := re.search(pattern, resps):
             resps = match[0]
         else:
@@ -143,64 +196,89 @@ def __table_definition__(tab: str) -> dict:
     """
     if tab not in __list_tables__():
         raise SqlTabError(tab=tab, tabs=__list_tables__())
-    cmd = f"PRAGMA table_info({tab})"
-    resp = __cmd_execute__([cmd])
-    resp_df = resp[cmd]
-    # fmt: off
-    resp_df["notnull"] = ( # type: ignore
-            resp_df["notnull"]
-            .apply(lambda x: "NOT NULL" if x else "")
-            )
-    resp_df["pk"] = ( # type: ignore
-            resp_df["pk"]
-            .apply(lambda x: "PRIMARY KEY" if x else "")
-            )
-    resp_df["type"] = (
-            resp_df[["type", "notnull", "pk"]] # type: ignore
-            .apply(tuple,axis=1)
-            .str.join(" ")
-            )
-    # fmt: on
-    resp_dict = resp_df.loc[:, ["name", "type"]].to_dict(orient="records")
-    return {i["name"]: i["type"] for i in resp_dict}
+
+    def read() -> dict:
+        cmd = f"PRAGMA table_info({tab})"
+        resp = __cmd_execute__([cmd])
+        resp_df = resp[cmd]
+        # fmt: off
+        resp_df["notnull"] = ( # type: ignore
+                resp_df["notnull"]
+                .apply(lambda x: "NOT NULL" if x else "")
+                )
+        resp_df["pk"] = ( # type: ignore
+                resp_df["pk"]
+                .apply(lambda x: "PRIMARY KEY" if x else "")
+                )
+        resp_df["type"] = (
+                resp_df[["type", "notnull", "pk"]] # type: ignore
+                .apply(tuple,axis=1)
+                .str.join(" ")
+                )
+        # fmt: on
+        resp_dict = resp_df.loc[:, ["name", "type"]].to_dict(orient="records")
+        return {i["name"]: i["type"] for i in resp_dict}
+
+    return __schema_cache__(("definition", tab), read)
 
 
 def __tab_foreign__(tab: str) -> List[Dict[str, str]]:
     """show FOREIGN keys for tab
     return empty list if no foreign key
     """
-    sql_cmd = f"pragma foreign_key_list({tab})"
-    resp = __cmd_execute__([sql_cmd])
-    if not resp or resp[sql_cmd].empty:
-        return []
-    foreign_tab = []
-    for _, r in resp[sql_cmd].iterrows():
-        key = {}
-        key[r["from"]] = r["table"] + "(" + r["to"] + ")"
-        foreign_tab.append(key)
-    return foreign_tab
 
+    def read() -> List[Dict[str, str]]:
+        sql_cmd = f"pragma foreign_key_list({tab})"
+        resp = __cmd_execute__([sql_cmd])
+        if not resp or resp[sql_cmd].empty:
+            return []
+        foreign_tab = []
+        for _, r in resp[sql_cmd].iterrows():
+            key = {}
+            key[r["from"]] = r["table"] + "(" + r["to"] + ")"
+            foreign_tab.append(key)
+        return foreign_tab
 
-def __write_table__(
-    dat: pd.DataFrame, tab: str, on_conflict: dict
-) -> Dict[str, pd.DataFrame]:
-    """writes DataFrame to SQL table 'tab'
-    Raises:
-        SqlExecuteError
+    return __schema_cache__(("foreign", tab), read)
+
+
+def __schema_cache__(key: tuple, read: Callable[[], Any]) -> Any:
+    """
+    return db schema info stored under key, call read() only when missing
+    cache lives as long as connection and until any DDL command
+    (see __invalidate_schema__())
+    return copy, so caller can modify
     """
-    # Create a copy to avoid modifying the original DataFrame
-    df_copy = dat.copy()
+    try:
+        connection.get()
+    except sqlite3.Error:  # pylint: disable=E1101
+        # let read() raise proper SqlExecuteError
+        return read()
+    if schema_cache.get("generation") != connection.generation:
+        __invalidate_schema__()
+    if key not in schema_cache:
+        schema_cache[key] = read()
+    return copy.deepcopy(schema_cache[key])
 
-    # Convert boolean columns to integers (0 for False, 1 for True)
-    for col in df_copy.select_dtypes(include=["bool"]).columns:
-        df_copy[col] = df_copy[col].astype(int)
 
-    # Replace pandas' NA/NaN with None for SQL compatibility
-    df_copy = df_copy.where(pd.notna(df_copy), None)
+def __invalidate_schema__() -> None:
+    """drop cached schema info, must follow any change of db structure"""
+    schema_cache.clear()
+    schema_cache["generation"] = connection.generation
 
-    # Convert to list of tuples, which executemany handles correctly
-    records = list(df_copy.itertuples(index=False, name=None))
 
+def __write_table__(
+    dat: pd.DataFrame, tab: str, on_conflict: dict, batch_audit: bool = False
+) -> Dict[str, float]:
+    """writes DataFrame to SQL table 'tab'
+    records are taken from columns batch by batch, without copy of whole DataFrame
+    all batches are written in one transaction
+    batch_audit: one compact audit record instead of one per row, see __batch_audit__()
+    return number of rows written and time taken in seconds
+    Raises:
+        SqlExecuteError
+    """
+    start = time.perf_counter()
     # single element tuple add coma which brake column names
     col_names = list_to_tuple_str(dat.columns)
 
@@ -216,7 +294,126 @@ def __write_table__(
               VALUES ({','.join(['?'] * len(dat.columns))})
            """
     cmd += update_cmd
-    return __cmd_execute__([cmd], records)
+    with __transaction__(), __batch_audit__(dat, tab, enable=batch_audit):
+        for i in range(0, len(dat), SQL_WRITE_BATCH):
+            batch = dat.iloc[i : i + SQL_WRITE_BATCH]
+            # list of tuples, which executemany handles correctly
+            records = list(zip(*(__sql_values__(batch[c]) for c in batch.columns)))
+            __cmd_execute__([cmd], records)
+    return {"rows": len(dat), "time": time.perf_counter() - start}
+
+
+@contextmanager
+def __batch_audit__(dat: pd.DataFrame, tab: str, enable: bool) -> Iterator[None]:
+    """
+    suspend row level audit (INSERT and UPDATE triggers) while writing dat to tab
+    and store one '{tab}.batch' record in audite_changefeed instead:
+        {"pk": primary key column,
+         "created": primary keys of new rows,
+         "old": rows before write (only those touched)}
+    rows are matched by primary key or UNIQUE columns of tab
+    when not possible (or tab not audited), nothing changes
+    must be used inside transaction, so triggers are never lost
+    Raises:
+        SqlExecuteError
+    """
+    if not enable:
+        yield
+        return
+    col_defs = __table_definition__(tab)
+    pk = [c for c in col_defs.keys() if "PRIMARY" in col_defs[c]]
+    unique = sql_scheme.get(tab, {}).get("UNIQUE", [])
+    if pk and pk[0] in dat.columns:
+        match = pk[:1]
+    elif unique and all(c in dat.columns for c in unique):
+        match = list(unique)
+    else:
+        match = []
+    triggers = {
+        t: __sqlite_master__(t)
+        for t in [f"audite_audit_{tab}_{e}_trigger" for e in ["insert", "update"]]
+    }
+    if dat.empty or not match or not all(triggers.values()):
+        yield
+        return
+
+    # touched rows are found by join with keys in temporary table
+    keys = [f"k{i}" for i in range(len(match))]
+    __cmd_execute__(
+        [
+            "DROP TABLE IF EXISTS temp.batch_keys",
+            f"CREATE TEMP TABLE batch_keys ({','.join(keys)})",
+        ]
+    )
+    __cmd_execute__(
+        [f"INSERT INTO temp.batch_keys VALUES ({','.join('?' * len(keys))})"],
+        list(zip(*(__sql_values__(dat[c]) for c in match))),
+    )
+    join = " AND ".join(f"t.{c} = k.{k}" for c, k in zip(match, keys))
+    # values as stored, to be written back by undo
+    cmd = (
+        f"SELECT {__raw_cols__(tab, 't')} FROM {tab} AS t "
+        + f"JOIN temp.batch_keys AS k ON {join}"
+    )
+    old = __cmd_execute__([cmd])[cmd]
+    dropped = [t for t, t_sql in triggers.items() if t_sql]
+    __cmd_execute__([f"DROP TRIGGER {t}" for t in dropped])
+
+    yield
+
+    cmd = f"SELECT t.{pk[0]} FROM {tab} AS t JOIN temp.batch_keys AS k ON {join}"
+    new = __cmd_execute__([cmd])[cmd]
+    old_keys = set(old[pk[0]].astype(str)) if not old.empty else set()
+    data = {
+        "pk": pk[0],
+        "created": (
+            [k for k in new[pk[0]].astype(str) if k not in old_keys]
+            if not new.empty
+            else []
+        ),
+        "old": [dict(zip(old.columns, r)) for r in __json_rows__(old)],
+    }
+    __cmd_execute__(
+        [
+            "INSERT INTO audite_changefeed (source, subject, type, specversion, data) "
+            "VALUES (?, ?, ?, '1.0', ?)"
+        ],
+        [tab, "batch", f"{tab}.batch", json.dumps(data)],
+    )
+    # recreate only what was dropped, triggers are not in schema_cache
+    __cmd_execute__([triggers[t] for t in dropped])
+
+
+def __sql_values__(col: pd.Series) -> list:
+    """
+    column values as python objects accepted by sqlite
+    NA/NaN -> None, bool stays bool (stored as 0/1 by sqlite)
+    """
+    values = col.tolist()
+    if col.hasnans:
+        return [None if na else v for v, na in zip(values, col.isna().tolist())]
+    return values
+
+
+def __raw_cols__(tab: str, alias: str = "") -> str:
+    """
+    select list of all columns of tab, with values as stored in db
+    DATE and TIMESTAMP columns are casted to TEXT, so not converted
+    to python dates (PARSE_DECLTYPES) and can be written back as they are
+    """
+    prefix = f"{alias}." if alias else ""
+    cols = []
+    for c, t in __table_definition__(tab).items():
+        if t.split(" ", 1)[0].upper() in ["DATE", "TIMESTAMP"]:
+            cols.append(f"CAST({prefix}{c} AS TEXT) AS {c}")
+        else:
+            cols.append(f"{prefix}{c}")
+    return ",".join(cols)
+
+
+def __json_rows__(dat: pd.DataFrame) -> list[list]:
+    """rows of dat as lists of python values (NA -> None), ready for json.dumps()"""
+    return dat.astype(object).where(dat.notna(), None).values.tolist()
 
 
 def __get_tab__(
@@ -225,7 +422,8 @@ def __get_tab__(
     search: list[str] | None,
     where: set[str],
     oper="IN",
-) -> Dict[str, pd.DataFrame]:
+    chunksize: int | None = None,
+) -> Dict[str, Any]:
     """get info from table
     return as Dict:
     - each key for column searched,
@@ -238,28 +436,76 @@ def __get_tab__(
         search: what to get, get all if None
         where: columns used for searching
         oper: operator [IN, >, <, <=, >=], common for each search
+        chunksize: if given, value is iterator of DataFrames with chunksize rows
+            (unique values only within chunk)
     Raises:
         SqlExecuteError
         SqlGetOperationError
     """
-    resp = {}
-    for c in where:
-        if not search:
-            cmd = f"SELECT {','.join(get_col)} FROM {tab}"
-        else:
-            # Create a placeholder string for the IN clause
-            if oper == "IN":
-                placeholders = ",".join("?" * len(search))
-            else:
+    get_col = list(get_col)
+    where = list(where)
+    if not search:
+        cmd = f"SELECT {','.join(get_col)} FROM {tab}"
+        if chunksize:
+            return {
+                c: (
+                    chunk.drop_duplicates()
+                    for chunk in __cmd_execute_iter__(cmd, None, chunksize)
+                )
+                for c in where
+            }
+        all_rows = __cmd_execute__([cmd])[cmd].drop_duplicates()
+        return {c: all_rows.copy() for c in where}
+
+    # one statement for all columns: each row is tagged with
+    # match flag per searched column, so table is scanned once
+    match = []
+    params = []
+    with ExitStack() as keys_table:
+        if oper == "IN":
+            # lazy reader needs keys table until consumed
+            placeholders, keys = keys_table.enter_context(
+                __search_keys__(search, repeat=len(where), keep=bool(chunksize))
+            )
+            params = keys or []
+        for i, c in enumerate(where):
+            if oper != "IN":
                 # check if numeric for operations like >,<,<=,>=
                 col_def = __table_definition__(tab=tab)[c]
                 if all(i not in col_def for i in ["INTEGER", "REAL"]):
                     raise SqlGetOperationError(col=c, oper=oper)
                 placeholders = "?"
-            cmd = f"SELECT {','.join(get_col)} FROM {tab} WHERE {c} {oper} ({placeholders})"
-        if resp_col := __cmd_execute__([cmd], search):
-            resp[c] = resp_col[cmd].drop_duplicates()
-    return resp
+                params += search
+            match.append(f"({c} {oper} ({placeholders})) AS __where_{i}")
+        cmd = (
+            f"SELECT {','.join(get_col + match)} FROM {tab} "
+            f"WHERE {' OR '.join(f'__where_{i}' for i in range(len(where)))}"
+        )
+        if chunksize:
+            return {
+                c: __where_chunks__(
+                    __cmd_execute_iter__(cmd, params or None, chunksize), i, get_col
+                )
+                for i, c in enumerate(where)
+            }
+        resp_df = __cmd_execute__([cmd], params or None)[cmd]
+    return {c: __where_split__(resp_df, i, get_col) for i, c in enumerate(where)}
+
+
+def __where_split__(resp_df: pd.DataFrame, i: int, get_col: list[str]) -> pd.DataFrame:
+    """take from __get_tab__() response rows matching i-th where column"""
+    if resp_df.empty or not (found := resp_df[f"__where_{i}"] == 1).any():
+        return pd.DataFrame()
+    return resp_df.loc[found, get_col].reset_index(drop=True).drop_duplicates()
+
+
+def __where_chunks__(
+    chunks: Iterator[pd.DataFrame], i: int, get_col: list[str]
+) -> Iterator[pd.DataFrame]:
+    """__where_split__() for each chunk, skip chunks without matching rows"""
+    for chunk in chunks:
+        if not (resp_df := __where_split__(chunk, i, get_col)).empty:
+            yield resp_df
 
 
 def __get__(  # pylint: disable=R0917, R0913, R0914, R0912
@@ -269,7 +515,8 @@ def __get__(  # pylint: disable=R0917, R0913, R0914, R0912
     where: List[str] | Set[str] | pd.Series | None = None,
     follow: bool = False,
     oper="IN",
-) -> Dict[str, pd.DataFrame]:
+    chunksize: int | None = None,
+) -> Dict[str, Any]:
     """get info from table
     return as Dict:
     - each key for column searched,
@@ -282,6 +529,8 @@ def __get__(  # pylint: disable=R0917, R0913, R0914, R0912
         search: what to get (default None for everything)
         where: columns used for searching (default None for everything)
         follow: if True, search in all FOREIGN sub-tables
+        chunksize: if given, value is iterator of DataFrames with chunksize rows
+            only first where column is searched then
     Raises:
         SqlExecuteError
         SqlGetError
@@ -303,8 +552,10 @@ def __get__(  # pylint: disable=R0917, R0913, R0914, R0912
     else:
         get_col = set(norm_to_list_str(get_col))
     if search is not None:
+        # bound as params, quotes need no escaping
         search = norm_to_list_str(search)
-        search = __escape_quote__(search)
+    if chunksize:
+        where = set(list(where)[:1])
 
     if not __tab_foreign__(tab):
         # if "FOREIGN" not in sql_scheme[tab].keys():
@@ -312,39 +563,107 @@ def __get__(  # pylint: disable=R0917, R0913, R0914, R0912
 
     if follow:
         # get tab DF and all that follow
-        resp = __get__(tab=tab)
-        base_tab = list(resp.values())[0] if resp else pd.DataFrame()
-
-        if base_tab.empty:
-            return {"": pd.DataFrame()}
-        for f in sql_scheme[tab].get("FOREIGN", []):
-            col, f_tab, f_col = unpack_foreign(f)
-            resp = __get__(tab=f_tab)
-            f_df = list(resp.values())[0] if resp else pd.DataFrame()
-            base_tab = base_tab.merge(f_df, left_on=col, right_on=f_col)
-        # mock __get_tab__ response
-        # key for each column to search and value for DF
-        resp = {}
-        for w in where:
-            if search:
-                resp[w] = base_tab.loc[base_tab[w].isin(search), :]
-            else:
-                resp[w] = base_tab
-            if get_col != all_cols:
-                if any(c not in resp[w].columns for c in get_col):
-                    raise SqlGetError(get_col, resp[w].columns.to_list())
-                resp[w] = resp[w].loc[:, list(get_col)]
+        resp = __get_follow__(
+            tab=tab,
+            get_col=get_col if get_col != all_cols else None,
+            search=search,
+            where=where,
+            oper=oper,
+            chunksize=chunksize,
+        )
 
     else:
         if any(g not in all_cols for g in get_col):
             raise SqlGetError(get_col, all_cols)
         resp = __get_tab__(
-            tab=tab, get_col=get_col, search=search, where=where, oper=oper
+            tab=tab,
+            get_col=get_col,
+            search=search,
+            where=where,
+            oper=oper,
+            chunksize=chunksize,
         )
 
     return resp
 
 
+def __get_follow__(
+    tab: str,
+    get_col: set[str] | None,
+    search: list[str] | None,
+    where: set[str],
+    oper="IN",
+    chunksize: int | None = None,
+) -> Dict[str, Any]:
+    """get info from table joined with all FOREIGN tables
+    join, filtering and columns selection is done by sqlite
+    columns are named as pandas merge would do: FOREIGN column is kept once
+    when the same name in both tables, other repeated names get '_x', '_y' suffix
+    return as Dict, same as __get_tab__()
+
+    Raises:
+        SqlExecuteError
+        SqlGetError
+        SqlGetOperationError
+    """
+    # column name in response: (table alias, table, column)
+    # in order of pandas merge: left columns, then right columns
+    cols = {c: (tab, tab, c) for c in __table_definition__(tab)}
+    joins = []
+    for i, f in enumerate(sql_scheme[tab].get("FOREIGN", [])):
+        col, f_tab, f_col = unpack_foreign(f)
+        alias = f"f{i}"
+        # FOREIGN column of tab, even if already renamed in response
+        joins.append(f"JOIN {f_tab} AS {alias} ON {tab}.{col} = {alias}.{f_col}")
+        right = {
+            c: (alias, f_tab, c)
+            for c in __table_definition__(f_tab)
+            if not c == f_col == col
+        }
+        both = set(cols) & set(right)
+        cols = {(c + "_x" if c in both else c): v for c, v in cols.items()}
+        cols |= {(c + "_y" if c in both else c): v for c, v in right.items()}
+
+    get_col = list(cols) if get_col is None else list(get_col)
+    if any(c not in cols for c in get_col):
+        raise SqlGetError(get_col, list(cols))
+    if search and any(w not in cols for w in where):
+        raise SqlGetError(list(where), list(cols))
+    select = ",".join(f"{cols[c][0]}.{cols[c][2]} AS {c}" for c in get_col)
+    cmd = f"SELECT {select} FROM {tab} {' '.join(joins)}"
+
+    def execute(where_cmd: str, params: list[str] | None) -> Any:
+        sql_cmd = f"{cmd}{where_cmd} ORDER BY {tab}.rowid"
+        if chunksize:
+            return __cmd_execute_iter__(sql_cmd, params, chunksize)
+        resp_df = __cmd_execute__([sql_cmd], params)[sql_cmd]
+        if resp_df.empty:
+            return pd.DataFrame(columns=pd.Index(get_col))
+        return resp_df
+
+    if not search:
+        all_rows = execute("", None)
+        return {w: all_rows for w in where}
+
+    resp = {}
+    with ExitStack() as keys_table:
+        if oper == "IN":
+            # lazy reader needs keys table until consumed
+            placeholders, params = keys_table.enter_context(
+                __search_keys__(search, keep=bool(chunksize))
+            )
+        for w in where:
+            alias, w_tab, w_col = cols[w]
+            if oper == "IN":
+                resp[w] = execute(f" WHERE {alias}.{w_col} IN ({placeholders})", params)
+            else:
+                col_def = __table_definition__(tab=w_tab)[w_col]
+                if all(i not in col_def for i in ["INTEGER", "REAL"]):
+                    raise SqlGetOperationError(col=w, oper=oper)
+                resp[w] = execute(f" WHERE {alias}.{w_col} {oper} (?)", search)
+    return resp
+
+
 def __cmd_execute__(
     script: List[str],
     params: Sequence[str | tuple[Any, ...] | list[str]] | None = None,
@@ -376,21 +695,18 @@ def __cmd_execute__(
         executemany = True
 
     if not executemany:
-        if len(params) > 900:
+        if len(params) > SQL_MAX_PARAMS:
             raise SqlExecuteError("Too many parameters: ", str(len(params)))
 
     try:
-        con = sqlite3.connect(  # pylint: disable=E1101
-            conf.DB_FILE,
-            detect_types=sqlite3.PARSE_COLNAMES  # pylint: disable=E1101
-            | sqlite3.PARSE_DECLTYPES,  # pylint: disable=E1101
-        )
-        cur = con.cursor()
-        if foreign_key:
-            cur.execute("PRAGMA foreign_keys = ON")
-        else:
-            cur.execute("PRAGMA foreign_keys = OFF")
-        cur.execute("PRAGMA recursive_triggers = OFF")
+        con = connection.get()
+    except sqlite3.Error as err:  # pylint: disable=E1101
+        raise SqlExecuteError(err=err, cmd=cmd, params=params) from err
+    cur = con.cursor()
+    if not foreign_key:
+        # must be set outside of transaction, other way no-op
+        cur.execute("PRAGMA foreign_keys = OFF")
+    try:
         for cmd in script:
             if executemany:
                 cur.executemany(cmd, params)
@@ -401,16 +717,119 @@ def __cmd_execute__(
                 ans[cmd] = pd.DataFrame(a, columns=col_names)
             else:
                 ans[cmd] = pd.DataFrame()
-        con.commit()
+        if not connection.depth:
+            con.commit()
         return ans
-    except sqlite3.IntegrityError as err:  # pylint: disable=E1101
-        con.rollback()  # type: ignore
+    except sqlite3.Error as err:  # pylint: disable=E1101
+        # connection stays open, so never leave transaction pending
+        # inside transaction() rollback is done when leaving context
+        if not connection.depth:
+            con.rollback()
         raise SqlExecuteError(err=err, cmd=cmd, params=params) from err
+    finally:
+        if not foreign_key:
+            cur.execute("PRAGMA foreign_keys = ON")
+        cur.close()
+        if any(DDL_CMD.match(c) for c in script):
+            __invalidate_schema__()
+
+
+@contextmanager
+def __transaction__() -> Iterator[None]:
+    """
+    group all sql commands inside context into one transaction
+    commit when leaving context, rollback on any exception (also KeyboardInterrupt)
+    nested contexts join the outer transaction
+    Raises:
+        SqlExecuteError
+    """
+    try:
+        con = connection.get()
+        if not connection.depth:
+            con.execute("BEGIN")
+    except sqlite3.Error as err:  # pylint: disable=E1101
+        raise SqlExecuteError(err=err, cmd="BEGIN", params=[]) from err
+    connection.depth += 1
+    try:
+        yield
+    except BaseException:
+        connection.depth -= 1
+        if not connection.depth:
+            con.rollback()
+        raise
+    connection.depth -= 1
+    if not connection.depth:
+        try:
+            con.commit()
+        except sqlite3.Error as err:  # pylint: disable=E1101
+            con.rollback()
+            raise SqlExecuteError(err=err, cmd="COMMIT", params=[]) from err
+
+
+def __cmd_execute_iter__(
+    cmd: str,
+    params: Sequence[str] | None,
+    chunksize: int,
+) -> Iterator[pd.DataFrame]:
+    """Execute one SELECT command and yield response as DataFrames
+    rows are fetched from cursor chunksize at a time, so memory stays bounded
+    nothing is yielded when no rows
+    Raises:
+        SqlExecuteError
+    """
+    try:
+        cur = connection.get().execute(cmd, params or [])
+    except sqlite3.Error as err:  # pylint: disable=E1101
+        raise SqlExecuteError(err=err, cmd=cmd, params=params) from err
+    try:
+        col_names = pd.Series([c[0] for c in cur.description])
+        while rows := cur.fetchmany(chunksize):
+            yield pd.DataFrame(rows, columns=col_names)
     except sqlite3.Error as err:  # pylint: disable=E1101
         raise SqlExecuteError(err=err, cmd=cmd, params=params) from err
     finally:
-        cur.close()  # type: ignore
-        con.close()  # type: ignore
+        cur.close()
+
+
+@contextmanager
+def __search_keys__(
+    search: list[str], repeat: int = 1, keep: bool = False
+) -> Iterator[tuple[str, list[str] | None]]:
+    """
+    give content of IN (...) clause and params for it
+    params are repeated when clause is used repeat times in one command
+    when all params are longer then SQL_MAX_PARAMS,
+    keys are bulk loaded into temporary table and subquery is given instead
+    each call has own temporary table, emptied for reuse when leaving context
+    (can not be dropped while lazy reader is open)
+    when keep (lazy readers), table is never reused
+    Raises:
+        SqlExecuteError
+    """
+    if len(search) * repeat <= SQL_MAX_PARAMS:
+        yield ",".join("?" * len(search)), search * repeat
+        return
+    if search_keys_free:
+        table = search_keys_free.pop()
+    else:
+        table = f"search_keys_{next(search_keys_id)}"
+    # table may be gone with connection
+    __cmd_execute__(
+        [
+            f"CREATE TEMP TABLE IF NOT EXISTS {table} (key)",
+            f"DELETE FROM temp.{table}",
+        ]
+    )
+    __cmd_execute__(
+        [f"INSERT INTO temp.{table} (key) VALUES (?)"],
+        [(k,) for k in search],
+    )
+    try:
+        yield f"SELECT key FROM temp.{table}", None
+    finally:
+        if not keep:
+            __cmd_execute__([f"DELETE FROM temp.{table}"])
+            search_keys_free.append(table)
 
 
 def __create_tab_cmd__(tab: str) -> str:
@@ -444,6 +863,33 @@ def __create_tab_cmd__(tab: str) -> str:
     return tab_cmd
 
 
+def __rm_unreferenced__(tab: str, col: str, value: list[str]) -> None:
+    """
+    remove rows where col in value,
+    but keep rows still referenced by FOREIGN key of other tables
+    Raises:
+        SqlExecuteError
+    """
+    with __search_keys__(value) as (placeholders, params):
+        cmd = f"DELETE FROM {tab} WHERE {col} IN ({placeholders})"
+        for t in sql_scheme:
+            for f in sql_scheme[t].get("FOREIGN", []):
+                f_col, f_tab, f_tab_col = unpack_foreign(f)
+                if f_tab == tab:
+                    cmd += (
+                        " AND NOT EXISTS"
+                        f" (SELECT 1 FROM {t} WHERE {t}.{f_col} = {tab}.{f_tab_col})"
+                    )
+        __cmd_execute__([cmd], params)
+
+
+def __db_size__() -> int:
+    """size of db in bytes, as number of used pages"""
+    cmd = ["PRAGMA page_count", "PRAGMA page_size"]
+    resp = __cmd_execute__(cmd)
+    return int(resp[cmd[0]].iloc[0, 0]) * int(resp[cmd[1]].iloc[0, 0])
+
+
 def __update_set__(tab: str, add_cols: Union[str, None]) -> str:
     """create ON_CONFLICT UPDATE_SET cmd"""
     cols = __table_definition__(tab=tab)
@@ -476,6 +922,52 @@ def __add_unique__(tab: Union[str, None] = None) -> None:
         cmd.append(f"CREATE UNIQUE INDEX uniqueRow_{t} ON {t} ({unique_cols})")
     if cmd:
         __cmd_execute__(cmd)
+    __invalidate_schema__()
+
+
+def __index_cols__(tab: str) -> Dict[str, str]:
+    """INDEX from sql_scheme as {index name: columns}"""
+    index = {}
+    for cols in sql_scheme[tab].get("INDEX", []):
+        cols = [cols] if isinstance(cols, str) else cols
+        index[f"index_{tab}_{'_'.join(cols)}"] = list_to_tuple_str(cols, quote=False)
+    return index
+
+
+def __changefeed_index__() -> None:
+    """
+    index audite_changefeed on time, used by undo, log reads and retention
+    (not created by audite)
+    Raises:
+        SqlExecuteError
+    """
+    __cmd_execute__(
+        [f"CREATE INDEX IF NOT EXISTS {CHANGEFEED_INDEX} ON {CHANGEFEED} (time, id)"]
+    )
+
+
+def __missing_index__(tab: str) -> List[str]:
+    """names of INDEX from sql_scheme not present in db"""
+    return [i for i in __index_cols__(tab) if not __sqlite_master__(name=i)]
+
+
+def __add_index__(tab: Union[str, None] = None) -> None:
+    """create INDEX for tables, or selected table if given
+    existing indexes and missing tables are skipped
+    Raises:
+        SqlExecuteError
+    """
+    cmd = []
+    if not tab:
+        tabs = [t for t in sql_scheme.keys() if t in __list_tables__()]
+    else:
+        tabs = [tab]
+    for t in tabs:
+        for name, cols in __index_cols__(t).items():
+            cmd.append(f"CREATE INDEX IF NOT EXISTS {name} ON {t} ({cols})")
+    if cmd:
+        __cmd_execute__(cmd)
+    __invalidate_schema__()
 
 
 def __defer_foreign__(tab: str) -> None:
@@ -516,6 +1008,7 @@ def __defer_foreign__(tab: str) -> None:
     # we will be copying tables
     # so temporary foreign keys  constraint may fail
     __cmd_execute__(cmd, foreign_key=False)
+    __invalidate_schema__()
 
 
 def __check_scheme__(tab: str, col_def: Dict) -> None:  # pylint: disable=R0912
@@ -536,6 +1029,14 @@ def __check_scheme__(tab: str, col_def: Dict) -> None:  # pylint: disable=R0912
         elif col in ["UNIQUE", "HASH_COLS"]:
             if not isinstance(col_def[col], List):
                 raise SqlSchemeError(tab=tab, key=col, expected="List")
+        elif col == "INDEX":
+            if not isinstance(col_def[col], List):
+                raise SqlSchemeError(tab=tab, key=col, expected="List")
+            for index in col_def[col]:
+                if not isinstance(index, (str, List)):
+                    raise SqlSchemeError(
+                        tab=tab, key=col, expected="List of String or List"
+                    )
         elif col == "ON_CONFLICT":
             if not isinstance(col_def[col], Dict):
                 raise SqlSchemeError(tab=tab, key=col, expected="Dict")
@@ -544,18 +1045,7 @@ def __check_scheme__(tab: str, col_def: Dict) -> None:  # pylint: disable=R0912
                 raise SqlSchemeError(tab=tab, key=col, expected="Dict")
 
 
-def __escape_quote__(txt: list[str]) -> list[str]:
-    """
-    escape quotes in a list of strings
-    """
-    return [re.sub(r"'", r"''", str(txt)) for txt in txt if txt is not None]
-
-
 def __audit__(tab: str) -> None:
     """add loging tables to sql"""
-    db = sqlite3.connect(  # pylint: disable=E1101
-        conf.DB_FILE,
-        detect_types=sqlite3.PARSE_COLNAMES  # pylint: disable=E1101
-        | sqlite3.PARSE_DECLTYPES,  # pylint: disable=E1101
-    )
-    track_changes(db, tables=[tab])
+    track_changes(connection.get(), tables=[tab])
+    __invalidate_schema__()
@@ -9,6 +9,7 @@ import re
 import sys
 from argparse import Namespace
 from datetime import date
+from typing import Iterable, Iterator
 
 import pandas as pd
 from pandas.core.dtypes.cast import NAType
@@ -19,9 +20,9 @@ from app.common import (
     check_dir_file,
     foreign_tabs,
     match_from_list,
-    read_json_dict,
+    read_scheme,
     tab_cols,
-    unpack_foreign,
+    tab_in_scheme,
 )
 from app.error import (
     AmbigousMatchError,
@@ -38,48 +39,187 @@ from app.manufacturers import (
 )
 from app.message import msg
 
+# columns used by msg.bom_import_summary()
+SUMMARY_COLS = [conf.DEV_ID, conf.SHOP_PRICE, conf.BOM_QTY]
 
-def import_tab(dat: pd.DataFrame, tab: str, args: Namespace, file: str) -> None:
-    """prepare tab as per config and sql_scheme and import"""
-    # rename (and tidy) columns according to format of imported file
-    # apply configuration from config.py
-    dat = columns_align(
-        dat.copy(),
-        file=file,
-        args=args,
-    )
 
-    # existing device for summary info reasons
-    ex_devs = sql.getL(tab="DEVICE", get_col=[conf.DEV_HASH])
+class ImportSession:
+    """
+    rows of all files imported in one command (see write_tab())
+    written to db at once with commit(), in one transaction
+    (streamed file is committed chunk by chunk):
+    DEVICE rows deduplicated on hash across files, one put per table
+    pending rows are visible to checks of following files
+    as if already written, old rows to overwrite are removed also with commit()
+    so user is asked before anything is written
+    """
 
-    try:
-        # align table with sql definition
-        # remove NAs in mandatory columns
-        dat = prepare_tab(
-            dat=dat.copy(),
-            tab=tab,
+    def __init__(self, tab: str, args: Namespace) -> None:
+        self.tab = tab
+        # align other cols or keep existing devices
+        self.on_conflict = {"action": "IGNORE"} if args.dont_align_columns else None
+        self.dat: list[pd.DataFrame] = []
+        self.devices = pd.DataFrame()
+        # summary per file: (data, number of already existing devices)
+        self.summary: list[tuple[pd.DataFrame, int]] = []
+        # rows to remove from db: (table, column, values)
+        self.removed: list[tuple[str, str, list]] = []
+        self.ex_devs = set(sql.getL(tab="DEVICE", get_col=[conf.DEV_HASH]))
+
+    def add(self, dat: pd.DataFrame, new_file: bool = True) -> None:
+        """add rows of one file, or next chunk of the same file"""
+        self.dat.append(dat)
+        # only columns needed for summary
+        summary = dat.loc[:, [c for c in SUMMARY_COLS if c in dat.columns]]
+        ex_devs = int(dat[conf.DEV_HASH].isin(self.ex_devs).sum())
+        if not new_file and self.summary:
+            prev, prev_ex = self.summary.pop()
+            summary = pd.concat([prev, summary])
+            ex_devs += prev_ex
+        self.summary.append((summary, ex_devs))
+        self.ex_devs |= set(dat[conf.DEV_HASH])
+        must_cols, nice_cols = tab_cols("DEVICE", all_cols=True)
+        dev_cols = [c for c in dat.columns if c in must_cols + nice_cols]
+        # as on conflict: UPDATE_SET - last row wins, IGNORE - first row wins
+        self.devices = pd.concat(
+            [self.devices, dat.loc[:, dev_cols]], ignore_index=True
+        ).drop_duplicates(
+            subset=[conf.DEV_HASH], keep="first" if self.on_conflict else "last"
+        )
+
+    def pending(self, col: str) -> list:
+        """values of col in pending rows"""
+        return [v for d in self.dat for v in d[col].to_list()]
+
+    def drop(self, col: str, values: list) -> None:
+        """remove pending rows where col in values (overwriting)"""
+        self.dat = [d.loc[~d[col].isin(values), :] for d in self.dat]
+
+    def rm(self, tab: str, col: str, values: list) -> None:
+        """remove rows where col in values from db with commit() and from pending"""
+        self.removed.append((tab, col, values))
+        self.drop(col, values)
+
+    def with_pending(self, existing: pd.DataFrame, hashes: pd.Series) -> pd.DataFrame:
+        """add pending devices with hashes to existing devices from db"""
+        if self.devices.empty:
+            return existing
+        pend = self.devices[conf.DEV_HASH].isin(hashes)
+        if not existing.empty:
+            pend &= ~self.devices[conf.DEV_HASH].isin(existing[conf.DEV_HASH])
+        if not pend.any():
+            return existing
+        return pd.concat([existing, self.devices.loc[pend, :]], ignore_index=True)
+
+    def commit(self) -> None:
+        """
+        remove overwritten rows and write all pending rows, one put per table
+        can be called many times, pending rows are cleared
+        """
+        dat = [d for d in self.dat if not d.empty]
+        if not dat and not self.removed:
+            return
+        with sql.transaction():
+            for tab, col, values in self.removed:
+                sql.rm(tab=tab, value=values, column=[col])
+            if dat:
+                sql.put(
+                    dat=self.devices,
+                    tab="DEVICE",
+                    on_conflict=self.on_conflict,
+                    batch_audit=True,
+                )
+                sql.put(
+                    dat=pd.concat(dat, ignore_index=True),
+                    tab=self.tab,
+                    batch_audit=True,
+                )
+        self.dat = []
+        self.devices = pd.DataFrame()
+        self.removed = []
+
+    def inform(self) -> None:
+        """summary of each file"""
+        if self.tab == "BOM":
+            for dat, ex_devs in self.summary:
+                msg.bom_import_summary(dat, ex_devs)
+
+
+def parse_tab(
+    dat: pd.DataFrame | Iterator[pd.DataFrame], tab: str, args: Namespace, file: str
+) -> pd.DataFrame | Iterator[pd.DataFrame] | None:
+    """
+    prepare tab as per config and sql_scheme, without touching db
+    nor asking user (can run in separate process, see import_dat.import_files())
+    dat can be also iterator of DataFrames (streamed file),
+    then iterator of prepared chunks is returned, chunks are prepared when read
+    return None if nothing to import
+    """
+    if isinstance(dat, pd.DataFrame):
+        return next(parse_chunks(chunks=[dat], tab=tab, args=args, file=file), None)
+    return parse_chunks(chunks=dat, tab=tab, args=args, file=file)
+
+
+def parse_chunks(
+    chunks: Iterable[pd.DataFrame], tab: str, args: Namespace, file: str
+) -> Iterator[pd.DataFrame]:
+    """align, clean and hash chunks of file, stop if chunk can not be prepared"""
+    first = True
+    for chunk in chunks:
+        # rename (and tidy) columns according to format of imported file
+        # apply configuration from config.py
+        chunk = columns_align(
+            chunk.copy(),
             file=file,
-            row_shift=conf.import_format[args.format]["header"],
+            args=args,
         )
-    except PrepareTabError as e:
-        msg.msg(str(e))
-        return
+        try:
+            # align table with sql definition
+            # remove NAs in mandatory columns
+            chunk = prepare_tab(
+                dat=chunk.copy(),
+                tab=tab,
+                file=file,
+                row_shift=conf.import_format[args.format]["header"],
+                inform=first,
+            )
+        except PrepareTabError as e:
+            msg.msg(str(e))
+            return
+        first = False
+        # hash columns - must be last so all columns aligned and present
+        yield hash_tab(dat=chunk)
 
-    # if we have stored alternatives, use it
-    dat.loc[:, conf.DEV_MAN], _ = use_alt_man(dat[conf.DEV_MAN].to_list())
 
-    # hash columns - must be last so all columns aligned and present
-    dat = hash_tab(dat=dat)
+def write_tab(
+    dat: pd.DataFrame,
+    tab: str,
+    args: Namespace,
+    session: ImportSession,
+    new_file: bool = True,
+) -> bool:
+    """
+    align data prepared with parse_tab() with existing data (asking user)
+    and add to import session, written to db with session.commit()
+    next chunks of streamed file (not new_file) are not checked for existing data,
+    as decided with first chunk
+    return False if user do not want to import
+    """
+    # if we have stored alternatives, use it
+    dat.loc[:, conf.DEV_MAN], replaced = use_alt_man(dat[conf.DEV_MAN].to_list())
+    if any(replaced):
+        # manufacturer is hashed
+        dat = hash_tab(dat=dat)
 
     # align other cols before skipping data in incoming data
-    on_conflict =  {"action": "IGNORE"}
     if not args.dont_align_columns:
-        on_conflict = None  # will take default: UPDATE_SET
         existing_data = sql.getDF(
             tab="DEVICE",
             search=dat.loc[:, conf.DEV_HASH],
             where=[conf.DEV_HASH],
         )
+        # devices from previous files as if already written
+        existing_data = session.with_pending(existing_data, dat[conf.DEV_HASH])
         try:
             miss_cols = existing_data.columns.difference(dat.columns)
             dat[miss_cols] = pd.DataFrame(
@@ -98,10 +238,11 @@ def import_tab(dat: pd.DataFrame, tab: str, args: Namespace, file: str) -> None:
             print(e)
             sys.exit(1)
     # check if data already in sql
-    if tab == "BOM" and not check_existing_project(dat, args):
-        return  # user do not want to overwrite nor add to existing data
-    if tab == "STOCK" and not check_existing_data(dat, args):
-        return
+    # removing old data is deferred to session.commit()
+    if new_file and tab == "BOM" and not check_existing_project(dat, args, session):
+        return False  # user do not want to overwrite nor add to existing data
+    if new_file and tab == "STOCK" and not check_existing_data(dat, args, session):
+        return False
 
     # check for alternative manufacturer on the same dev_id
     # just inform that alignment can be done with admin functions
@@ -112,28 +253,19 @@ def import_tab(dat: pd.DataFrame, tab: str, args: Namespace, file: str) -> None:
 
     # inform if data useful for other tabs is present
     tabs = tabs_in_data(dat)
-    if "SHOP" in tabs and tab != "SHOP":
+    if new_file and "SHOP" in tabs and tab != "SHOP":
         msg.msg("Detected data usefull also for SHOP table.")
         msg.msg("Consider importing with 'shop_cart_import' option.")
-    # write aligned data to SQL
-    for t in ["DEVICE", tab]:
-        if t == "DEVICE":
-            sql.put(dat=dat, tab=t, on_conflict=on_conflict)
-        else:
-            sql.put(dat=dat, tab=t)
-
-    # SUMMARY
-    if tab == "BOM":
-        msg.bom_import_summary(dat, len(dat[dat[conf.BOM_HASH].isin(ex_devs)]))
+    session.add(dat, new_file=new_file)
+    return True
 
 
 def tabs_in_data(dat: pd.DataFrame) -> list[str]:
     """
     return all tables which mandatory cols are present in dat
     """
-    sql_scheme = read_json_dict(conf.SQL_SCHEME)
     # need to start from DEVICE because other tables refer to it
-    tabs = sorted(list(sql_scheme.keys()), key=lambda x: (x != "DEVICE", x))
+    tabs = sorted(tab_in_scheme(), key=lambda x: (x != "DEVICE", x))
     for t in tabs[:]:
         must_cols, _ = tab_cols(t)
         # check if all required columns are in aligned_dat
@@ -148,12 +280,14 @@ def prepare_tab(
     tab: str,
     file: str,
     row_shift: int,
+    inform: bool = True,
 ) -> pd.DataFrame:
     """
     prepares and check if data aligned with table.
     iterate through tabs and check if mandatory columns present
     return only tables with all mandatory columns
     and sanitazed data
+    inform about project taken from file name only when 'inform'
 
     check columns: mandatary, nice to have
     """
@@ -167,58 +301,66 @@ def prepare_tab(
             lambda cell: cell.split(".")[0]
         )
         missing_cols = [c for c in missing_cols if c != conf.BOM_PROJECT]
-        msg.project_as_filename()
+        if inform:
+            msg.project_as_filename()
     # must after 'project' column creation, otherway possibly missing
     if any(missing_cols):
         raise PrepareTabError(tab, file, missing_cols)
 
-    # clean text, leave only ASCII
+    # clean text, leave only ASCII and strip
     # i.e. easyEDM writes manufactuere in Chinese in parenthesis
     for c in dat.columns:
         if dat[c].dtype == "object":
-            dat[c] = dat[c].apply(ASCII_txt)
+            dat[c] = ASCII_col(dat[c])
 
     # remove rows with NA in must_cols
-    # must be afterASCII_txt, becouse it is possible to have only chinese in must_col
+    # must be after ASCII_col, becouse it is possible to have only chinese in must_col
     dat = NA_rows(dat, must_cols, nice_cols, row_shift)
 
-    # and strip text
-    for col in dat.select_dtypes(include=["object"]).columns:
-        dat[col] = dat[col].apply(lambda x: x.strip() if isinstance(x, str) else x)
-
     return dat
 
 
+def hash_rows(dat: pd.DataFrame, cols: list[str]) -> pd.Series:
+    """
+    sha256 of concatenated cols values (as str) for each row
+    columns are joined as whole arrays, only hashing is done per row
+    """
+    combined = dat[cols[0]].astype(str)
+    for c in cols[1:]:
+        combined = combined + dat[c].astype(str)
+    return pd.Series(
+        [hashlib.sha256(s.encode()).hexdigest() for s in combined],
+        index=dat.index,
+        dtype=object,
+    )
+
+
 def hash_tab(dat: pd.DataFrame) -> pd.DataFrame:
     """
     hash columns as per foreign key in SQLscheme
     also unpack foreign key to make sure all columns present
     """
-    sql_scheme = read_json_dict(conf.SQL_SCHEME)
-
-    def apply_hash(row: pd.Series, cols: list[str]) -> str:
-        combined = "".join(str(row[c]) for c in cols)
-        return hashlib.sha256(combined.encode()).hexdigest()
-
-    def hash_t(t):
-        hash_cols = sql_scheme[t].get("HASH_COLS", [])
-        if hash_cols:
-            dat["hash"] = dat.apply(lambda row: apply_hash(row, hash_cols), axis=1)
+    sql_scheme = read_scheme()
 
     tabs = tabs_in_data(dat)
     for t in tabs[:]:
         tabs += foreign_tabs(t)
     tabs = list(set(tabs))
 
+    # tables sharing the same HASH_COLS are hashed only once
+    hashes = {}
     for t in tabs:
-        hash_t(t)
+        hash_cols = tuple(sql_scheme.hash_cols(t))
+        if hash_cols:
+            if hash_cols not in hashes:
+                hashes[hash_cols] = hash_rows(dat, list(hash_cols))
+            dat["hash"] = hashes[hash_cols]
 
     # add foreign col in case it's not present yet
     # for example if we have FOREIGN:[{'dev_hash':'dev(hash)'}]
     # col hash exists, but now we need to copy hash to dev_hash
     for t in tabs:
-        for f in sql_scheme[t].get("FOREIGN", []):
-            to_col, _, from_col = unpack_foreign(f)
+        for to_col, _, from_col in sql_scheme.foreign(t):
             dat[to_col] = dat[from_col]
     return dat
 
@@ -270,22 +412,27 @@ def columns_align(n_stock: pd.DataFrame, file: str, args: Namespace) -> pd.DataF
         )
 
     # apply formatter functions
+    # 'frame_func' takes whole DataFrame, 'func' is applied row by row
+    if f := conf.import_format[args.format].get("frame_func"):
+        n_stock = f(n_stock)
     if f := conf.import_format[args.format].get("func"):
         n_stock = n_stock.apply(f, axis=1, result_type="broadcast")  # type: ignore
 
     # change columns type
-    # only for existing cols
-    n_stock = n_stock.astype(object)
+    # only for existing cols, not typed already when reading file
     if dtype := conf.import_format[args.format].get("dtype"):
-        exist_col_dtypes = {k: v for k, v in dtype.items() if k in n_stock.columns}
+        exist_col_dtypes = {
+            k: v
+            for k, v in dtype.items()
+            if k in n_stock.columns and n_stock[k].dtype != pd.api.types.pandas_dtype(v)
+        }
         try:
             n_stock = n_stock.astype(exist_col_dtypes)
         except ValueError as e:
             msg.msg(str(e))
             sys.exit(1)
 
-    # Strip whitespace from all string elements in the DataFrame
-    n_stock = n_stock.map(lambda x: x.strip() if isinstance(x, str) else x)
+    # text is cleaned and stripped in prepare_tab()
 
     # add column with path and file name and supplier
     n_stock[conf.BOM_DIR] = os.path.abspath(args.dir)
@@ -303,18 +450,42 @@ def columns_align(n_stock: pd.DataFrame, file: str, args: Namespace) -> pd.DataF
 def ASCII_txt(  # pylint: disable=invalid-name
     txt: str | None | NAType,
 ) -> str | None | NAType:  # pylint: disable=invalid-name
-    """remove any chinese signs from string columns"""
-    if not isinstance(txt, str):
-        return txt
-    if pd.isna(txt):
-        return None
-    txt = str(txt).replace("Ω", "ohm")
-    txt = txt.encode("ascii", "ignore").decode("ascii")
-    # remove any empty paranthases '()' from string columns
-    txt = re.sub(r"\(.*?\)", "", txt)
-    if not txt:  # only chinese letters
-        return None
-    return txt
+    """remove any chinese signs from string"""
+    return ASCII_col(pd.Series([txt], dtype=object), strip=False).iloc[0]
+
+
+def ASCII_col(  # pylint: disable=invalid-name
+    col: pd.Series, strip: bool = True
+) -> pd.Series:
+    """
+    remove any chinese signs from string column, at once for whole column:
+    'Ω' to 'ohm', leave only ASCII, remove paranthases with content, strip
+    empty strings (i.e. only chinese letters) become None
+    other than str values are kept
+    """
+    # each distinct value is cleaned only once
+    codes, uniques = pd.factorize(col)
+    if not len(uniques):  # pylint: disable=use-implicit-booleaness-not-len
+        return col
+    try:
+        txt = (
+            pd.Series(uniques, dtype=object)
+            .str.replace("Ω", "ohm", regex=False)
+            .str.encode("ascii", "ignore")
+            .str.decode("ascii")
+            .str.replace(r"\(.*?\)", "", regex=True)
+        )
+    except AttributeError:
+        # no strings in column
+        return col.infer_objects()
+    if strip:
+        txt = txt.str.strip()
+    txt = txt.astype(object)
+    # non str values are NaN after .str, take them from col
+    is_txt = txt.notna().to_numpy()[codes] & (codes != -1)
+    txt[txt.eq("")] = None
+    txt = pd.Series(txt.to_numpy()[codes], index=col.index, dtype=object)
+    return txt.where(is_txt, col).infer_objects()
 
 
 def align_data(dat: pd.DataFrame) -> pd.DataFrame:
@@ -389,22 +560,21 @@ def align_data(dat: pd.DataFrame) -> pd.DataFrame:
     return keep_dev
 
 
-def check_existing_project(dat: pd.DataFrame, args: Namespace) -> bool:
+def check_existing_project(
+    dat: pd.DataFrame, args: Namespace, session: ImportSession
+) -> bool:
     """
-    check if project already present in BOM
+    check if project already present in BOM (or in previous files of session)
     if -overwrite, remove existing data
     other way ask for confirmation
     return True if we can continue
     """
     old_project = sql.getL(tab="BOM", get_col=[conf.BOM_PROJECT])
+    old_project += session.pending(conf.BOM_PROJECT)
     project = dat.loc[0, conf.BOM_PROJECT]
     if args.overwrite:
         # remove all old data
-        sql.rm(
-            tab="BOM",
-            value=dat[conf.BOM_PROJECT].to_list(),
-            column=[conf.BOM_PROJECT],
-        )
+        session.rm("BOM", conf.BOM_PROJECT, dat[conf.BOM_PROJECT].to_list())
         return True
     # warn about adding qty
     if project in old_project:
@@ -413,14 +583,17 @@ def check_existing_project(dat: pd.DataFrame, args: Namespace) -> bool:
     return True
 
 
-def check_existing_data(dat: pd.DataFrame, args: Namespace) -> bool:
+def check_existing_data(
+    dat: pd.DataFrame, args: Namespace, session: ImportSession
+) -> bool:
     """
-    check if data already present in STOCK
+    check if data already present in STOCK (or in previous files of session)
     if -overwrite, remove existing data
     other way ask for confirmation
     return True if we can continue
     """
     old_data = sql.getL(tab="STOCK", get_col=[conf.STOCK_HASH])
+    old_data += session.pending(conf.STOCK_HASH)
     overlap_data = dat.loc[dat[conf.STOCK_HASH].isin(old_data), :]
     if overlap_data.empty:
         # no existing data so -overwrite dosent make sense
@@ -428,11 +601,7 @@ def check_existing_data(dat: pd.DataFrame, args: Namespace) -> bool:
         return True
     if args.overwrite:
         # remove all old data
-        sql.rm(
-            tab="STOCK",
-            value=overlap_data[conf.STOCK_HASH].to_list(),
-            column=[conf.STOCK_HASH],
-        )
+        session.rm("STOCK", conf.STOCK_HASH, overlap_data[conf.STOCK_HASH].to_list())
         return True
     # warn about adding qty
     if not overlap_data.empty:
@@ -550,11 +719,4 @@ def tab_template(tab: str, args: Namespace) -> None:
 
 def col_description() -> dict:
     """extract columns descriptions from sql_scheme"""
-    sql_scheme = read_json_dict(conf.SQL_SCHEME)
-    col_desc = {}
-    for _, cont in sql_scheme.items():
-        if "COL_DESCRIPTION" in cont:
-            for k, v in cont["COL_DESCRIPTION"].items():
-                if k not in col_desc:
-                    col_desc[k] = v
-    return col_desc
+    return read_scheme().col_description()
@@ -14,7 +14,14 @@ import conf.sql_colnames as colnames  # pylint: disable=unused-import
 from conf.sql_colnames import *  # pylint: disable=unused-wildcard-import,wildcard-import
 
 # list of keywords to be ignored during reading columns from tab
-SQL_KEYWORDS = ["FOREIGN", "UNIQUE", "ON_CONFLICT", "HASH_COLS", "COL_DESCRIPTION"]
+SQL_KEYWORDS = [
+    "FOREIGN",
+    "UNIQUE",
+    "INDEX",
+    "ON_CONFLICT",
+    "HASH_COLS",
+    "COL_DESCRIPTION",
+]
 TAKE_LONGER_COLS = [DEV_MAN, DEV_DESC, DEV_PACK]
 HIDDEN_COLS = [
     BOM_DIR,
@@ -31,7 +38,20 @@ NO_EXPORT_COLS = [
     SHOP_HASH,
     "id",
 ]  # columns not exported
-IMPORT_FORMAT_SPECIAL_KEYS = ["cols", "dtype", "func", "file_ext", "shop"]
+CHECKPOINT_TABS = ["DEVICE", "BOM", "SHOP", "STOCK"]  # tables with snapshots
+NO_AUDIT_TABS = ["CHECKPOINT"]  # tables not tracked in audite_changefeed
+EXPORT_CHUNK_ROWS = 10_000  # rows read from db at once during export
+XLSX_STREAM_SIZE = 5_000_000  # xlsx files bigger then this (bytes) are read in chunks
+IMPORT_CHUNK_ROWS = 10_000  # rows read from streamed file at once
+IMPORT_WORKERS = os.cpu_count() or 1  # processes parsing import files in parallel
+IMPORT_FORMAT_SPECIAL_KEYS = [
+    "cols",
+    "dtype",
+    "func",
+    "frame_func",
+    "file_ext",
+    "shop",
+]
 
 # Determine the absolute path of the installed module root.
 # This is done by getting the path of this config file and going up one level.
@@ -109,6 +129,10 @@ def write_TOML(path: str):  # pylint: disable=invalid-name
         path,
         base_conf.get("MAN_ALT", "manufacturer_alternatives.jsonc"),
     )
+    base_conf["LOG_KEEP"] = base_conf.get("LOG_KEEP", 100)
+    base_conf["LOG_KEEP_DAYS"] = base_conf.get("LOG_KEEP_DAYS", 0)
+    base_conf["CHECKPOINT_FREQ"] = base_conf.get("CHECKPOINT_FREQ", 0)
+    base_conf["CHECKPOINT_KEEP"] = base_conf.get("CHECKPOINT_KEEP", 3)
     base_conf["BOM_EXPORT_COL"] = base_conf.get(
         "BOM_EXPORT_COL",
         [
@@ -185,6 +209,16 @@ DISP_CURR = str(toml_loc.get("DISP_CURR", toml_def["DISP_CURR"]))
 # backup frequency
 BACKUP_FREQ = int(toml_loc.get("BACKUP_FREQ", toml_def["BACKUP_FREQ"]))
 
+# history retention for undo: keep last LOG_KEEP commands
+# and all commands from last LOG_KEEP_DAYS days (0 means no limit)
+LOG_KEEP = int(toml_loc.get("LOG_KEEP", toml_def["LOG_KEEP"]))
+LOG_KEEP_DAYS = int(toml_loc.get("LOG_KEEP_DAYS", toml_def["LOG_KEEP_DAYS"]))
+
+# snapshot of CHECKPOINT_TABS every CHECKPOINT_FREQ commands (0 to disable)
+# only last CHECKPOINT_KEEP snapshots are kept
+CHECKPOINT_FREQ = int(toml_loc.get("CHECKPOINT_FREQ", toml_def["CHECKPOINT_FREQ"]))
+CHECKPOINT_KEEP = int(toml_loc.get("CHECKPOINT_KEEP", toml_def["CHECKPOINT_KEEP"]))
+
 # directory for temporary files
 TEMP_DIR = str(toml_loc.get("TEMP_DIR", toml_def["TEMP_DIR"]))
 
@@ -209,38 +243,42 @@ SQL_SCHEME = os.path.join(MODULE_PATH, "conf", "sql_scheme.jsonc")
 
 
 # FILE IMPORT FORMATTERS
-def mouser(row: pd.Series) -> pd.Series:
+def mouser(df: pd.DataFrame) -> pd.DataFrame:
     """
-    function passed to pandas apply() on DataFrame rows
-    (row by row). Format/change value and return new value.
+    function called with whole DataFrame (column by column).
+    Format/change values and return new DataFrame.
     Used during file import, see import foramtter below
     """
-    if "order_qty" in row.index:
-        row["order_qty"] = 1
-    if "price" in row.index:
-        try:
-            row["price"] = float(str(row["price"]).replace("$", ""))
-        except ValueError:
-            # there are some summary rows at end, causing strings in price col
-            row["price"] = 0
-    return row
-
-
-def easyEDA(row: pd.Series) -> pd.Series:  # pylint: disable=invalid-name
+    if "order_qty" in df.columns:
+        df["order_qty"] = 1
+    if "price" in df.columns:
+        price = pd.to_numeric(
+            df["price"].astype(str).str.replace("$", "", regex=False).str.strip(),
+            errors="coerce",
+        )
+        # there are some summary rows at end, causing strings in price col
+        df["price"] = price.where(price.notna() | df["price"].isna(), 0)
+    return df
+
+
+def easyEDA(df: pd.DataFrame) -> pd.DataFrame:  # pylint: disable=invalid-name
     """merge column 'value' with 'description'"""
-    if "value" in row.index and "device_description" in row.index:
-        if not bool(pd.isna(row["value"])):
-            row["device_description"] = (
-                str(row["value"]) + " : " + str(row["device_description"])
-            )
-    return row
+    if "value" in df.columns and "device_description" in df.columns:
+        df["device_description"] = df["device_description"].where(
+            df["value"].isna(),
+            df["value"].astype(str) + " : " + df["device_description"].astype(str),
+        )
+    return df
 
 
-def csvLCSC(row: pd.Series) -> pd.Series:  # pylint: disable=invalid-name
-    """merge column 'value' with 'description'"""
-    if "order_qty" in row.index:
-        row["order_qty"] = row["order_qty"].split("\\")[0]  # pyright: ignore
-    return row
+def csvLCSC(df: pd.DataFrame) -> pd.DataFrame:  # pylint: disable=invalid-name
+    """leave only minimum order qty"""
+    if "order_qty" in df.columns:
+        qty = df["order_qty"]
+        df["order_qty"] = qty.where(
+            qty.isna(), qty.astype(str).str.split("\\", regex=False).str[0]
+        )
+    return df
 
 
 # pased to pandas read_excel() function as args and kwargs
@@ -251,7 +289,11 @@ def csvLCSC(row: pd.Series) -> pd.Series:  # pylint: disable=invalid-name
 #           use pandas object, Int64 (capital I !!)
 #           or float64 (also for int) to allow proper
 #           NaN handling (Int64 do not have NaN)
+# 'frame_func' - function performed on whole DataFrame, shall return DataFrame
+#           use column operations (fast)
 # 'func' - function performed on each row with pandas.apply()
+#           (slow, kept for compatibility)
+# formats without 'func' or 'frame_func' read only columns in 'cols' or in sql_scheme
 # 'file_ext' - file extension for file searching functions
 import_format = {
     "LCSC": {
@@ -295,7 +337,7 @@ import_format = {
             "qty": "Int64",
             "package": str,
         },  # lower case only, after cols rename!
-        "func": easyEDA,
+        "frame_func": easyEDA,
     },
     "mouser": {
         "file_ext": ["xls", "xlsx"],
@@ -314,7 +356,7 @@ import_format = {
             "qty": "Int64",
             "price": "float64",
         },
-        "func": mouser,
+        "frame_func": mouser,
         "shop": "mouser",
     },
     "csv": {
@@ -340,7 +382,7 @@ import_format = {
             "min\\mult order qty.": "order_qty",
         },
         "dtype": {"qty": "Int64", "price": "float64"},
-        "func": csvLCSC,
+        "frame_func": csvLCSC,
         "shop": "LCSC",
     },
 }
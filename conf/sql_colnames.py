@@ -31,3 +31,7 @@ MAN_ALT_NAME = "manufacturer_alt_name"
 # LOG table
 LOG_DATE = "date"
 LOG_ARGS = "args"
+# CHECKPOINT table
+CHECKPOINT_DATE = "date"
+CHECKPOINT_TAB = "tab"
+CHECKPOINT_DATA = "data"
@@ -4,6 +4,7 @@
 import argparse
 import datetime
 import inspect
+import os
 import sys
 from datetime import datetime
 
@@ -19,6 +20,7 @@ from app.error import SqlCheckError, SqlCreateError
 from app.import_dat import bom_import, shop_import, stock_import
 from app.message import msg
 from app.sql import check
+from app.sql_connection import connection
 from app.transaction import trans
 
 
@@ -409,6 +411,29 @@ def _add_admin_parser(command_parser):
             Column names must match between old and new schema.
             Keeps all data untouched.""",
     )
+    admin_group.add_argument(
+        "--prune_log",
+        action="store_true",
+        help="""Remove old history of commands (and possibility to undo them)
+            and reclaim disk space. How much history is kept is set by LOG_KEEP
+            and LOG_KEEP_DAYS in config, older history is also removed
+            with each command.""",
+    )
+    admin_group.add_argument(
+        "--restore_checkpoint",
+        action="store_true",
+        help="""Restore db to state from before selected command, using table
+            snapshots taken every CHECKPOINT_FREQ commands (see config).
+            Faster than --undo for long history.""",
+    )
+    admin_group.add_argument(
+        "--state_at",
+        metavar="TAB",
+        type=str.upper,
+        choices=conf.CHECKPOINT_TABS,
+        help="""Show table TAB (one of %(choices)s) as it was before selected
+            command. Starts from nearest checkpoint, see --restore_checkpoint.""",
+    )
     admin_group.add_argument(
         "-c",
         "--display_config",
@@ -552,6 +577,46 @@ def cli_parser() -> AbbreviationParser:
     return cli
 
 
+def read_only_cmd(args: argparse.Namespace) -> bool:
+    """
+    commands only reading db (export, info, fzf, display config, state_at)
+    for them db is not checked nor backuped and is opened read-only
+    """
+    if getattr(args, "command", None) == "admin":
+        # any other admin action may write
+        admin_args = [
+            "undo",
+            "sql_upgrade",
+            "prune_log",
+            "restore_checkpoint",
+            "backup_config",
+            "restore_config",
+            "set_local_config",
+            "import_manufacturers",
+            "export_manufacturers",
+            "align_manufacturers",
+            "remove_project",
+            "remove_dev_id",
+            "remove_shop_id",
+        ]
+        if any(getattr(args, a, None) for a in admin_args):
+            return False
+        read_args = ["display_config", "state_at"]
+        return any(getattr(args, a, None) for a in read_args)
+    write_args = [
+        "add_project",
+        "add_device_id",
+        "add_device_manufacturer",
+        "use_project",
+        "use_device_id",
+        "use_device_manufacturer",
+    ]
+    if any(getattr(args, a, None) for a in write_args):
+        return False
+    read_args = ["info", "csv_template", "export", "fzf"]
+    return any(getattr(args, a, None) for a in read_args)
+
+
 if __name__ == "__main__":
     # when debugging with debugpy, it should be somewhere in path
     # of one of the stack frame
@@ -564,10 +629,16 @@ if __name__ == "__main__":
     parser = cli_parser()
     args = parser.parse_args()
 
+    # read-only commands do not need check nor backup
+    # and shall not block other process writing to db
+    read_only = read_only_cmd(args) and os.path.isfile(conf.DB_FILE)
+    if read_only:
+        connection.read_only = True
+
     # check if we have proper sql file
     # but skip to allow upgrading
     args_skip = [getattr(args, a, False) for a in ["sql_upgrade", "restore_config"]]
-    if not any(args_skip):
+    if not any(args_skip) and not read_only:
         try:
             check()
         except SqlCheckError as e:
@@ -576,7 +647,7 @@ if __name__ == "__main__":
         except SqlCreateError as e:
             msg.msg(str(e))
             sys.exit(1)
-    if conf.DEBUG != "pytest":
+    if conf.DEBUG != "pytest" and not read_only:
         # backup config folder every BACKUP_FREQ days
         last_backup = str_to_date_backup(list_backups()[-1])
         diff = datetime.now() - last_backup
@@ -5,10 +5,11 @@ from unittest.mock import patch
 
 import pandas as pd
 
-from app import sql
+from app import sql, sql_core
 from app.admin import admin, align, remove_dev, select_log_undo
 from app.import_dat import bom_import, shop_import
 from app.log import log
+from conf import config as conf
 from conf.config import BOM_QTY, DEV_DESC, DEV_ID, DEV_MAN
 
 
@@ -800,3 +801,183 @@ def test_remove_show_all_projects(cli, db_setup, tmpdir, capsys):
     out, _ = capsys.readouterr()
     assert "test1" in out.lower()
     assert "test2" in out.lower()
+
+
+def test_undo_collapse(db_setup):
+    """many changes of the same rows are undone to state before first change"""
+    dev = pd.DataFrame(
+        {"hash": ["h1"], "device_id": ["d1"], "device_manufacturer": "m", DEV_DESC: "a"}
+    )
+    sql.put(dev, "DEVICE")
+    time.sleep(1)
+    undo_date = int(time.time())
+    sql.put(dev.assign(**{DEV_DESC: "b"}), "DEVICE")
+    sql.put(dev.assign(**{DEV_DESC: "c"}), "DEVICE")
+    sql.put(dev.assign(hash="h2"), "DEVICE")
+    sql.put(pd.DataFrame({"device_hash": ["h2"], "qty": [1], "project": "p"}), "BOM")
+    sql.rm("DEVICE", value=["h1"], column=["hash"])
+    sql.undo(undo_date)
+    devices = sql.getDF(tab="DEVICE")
+    assert devices["hash"].to_list() == ["h1"]
+    assert devices[DEV_DESC].to_list() == ["a"]
+    assert sql.getDF(tab="BOM").empty
+
+
+def test_prune_log(db_setup, cli, monkeypatch, capsys):
+    """keep only last LOG_KEEP commands and their history"""
+    monkeypatch.setattr(conf, "LOG_KEEP", 1)
+    log.log_on = False
+    dev = pd.DataFrame(
+        {"hash": ["h1"], "device_id": ["d1"], "device_manufacturer": "m"}
+    )
+    sql.put(dev, "DEVICE")
+    sql.put(pd.DataFrame({"date": [1, 2], "args": ["old", "new"]}), "LOG")
+    sql_core.__cmd_execute__(["UPDATE audite_changefeed SET time = 1"])
+    args = cli.parse_args(["admin", "--prune_log"])
+    admin(args)
+    out, _ = capsys.readouterr()
+    assert "removed 1 commands from log" in out.lower()
+    assert sql.getDF(tab="LOG")["args"].to_list() == ["new"]
+    assert sql.getDF(tab="audite_changefeed").empty
+
+
+def test_prune_log_auto(db_setup, monkeypatch):
+    """history is pruned with each logged command, changefeed is indexed"""
+    assert sql_core.__sqlite_master__(sql_core.CHANGEFEED_INDEX)
+    monkeypatch.setattr(conf, "LOG_KEEP", 2)
+    log.log_on = False
+    sql.put(pd.DataFrame({"date": [1, 2], "args": ["old", "new"]}), "LOG")
+    sql_core.__cmd_execute__(["UPDATE audite_changefeed SET time = 1"])
+    log.log_on = True
+    dev = pd.DataFrame(
+        {"hash": ["h1"], "device_id": ["d1"], "device_manufacturer": "m"}
+    )
+    sql.put(dev, "DEVICE")
+    assert sql.getDF(tab="LOG")["args"].to_list()[:1] == ["new"]
+    assert len(sql.getDF(tab="LOG")) == 2
+    feed = sql.getDF(tab="audite_changefeed")
+    assert feed["type"].to_list() == ["LOG.created", "DEVICE.created"]
+
+
+def test_undo_batch_audit(db_setup):
+    """bulk write stores one audit record, which undo understands"""
+    dev = pd.DataFrame(
+        {
+            "hash": ["h1", "h2"],
+            "device_id": ["d1", "d2"],
+            "device_manufacturer": "m",
+            DEV_DESC: "a",
+        }
+    )
+    sql.put(dev.iloc[:1], "DEVICE")
+    time.sleep(1)
+    undo_date = int(time.time())
+    sql.put(dev.assign(**{DEV_DESC: "b"}), "DEVICE", batch_audit=True)
+    bom = pd.DataFrame({"device_hash": ["h1", "h2"], "qty": 1, "project": "p"})
+    sql.put(bom, "BOM", batch_audit=True)
+    feed = sql.getDF("audite_changefeed", search=[undo_date], where=["time"], oper=">=")
+    assert feed["type"].to_list() == ["DEVICE.batch", "BOM.batch"]
+    sql.undo(undo_date)
+    devices = sql.getDF(tab="DEVICE")
+    assert devices["hash"].to_list() == ["h1"]
+    assert devices[DEV_DESC].to_list() == ["a"]
+    assert sql.getDF(tab="BOM").empty
+    # triggers are back
+    sql.put(bom.iloc[:1], "BOM")
+    feed = sql.getDF("audite_changefeed", get_col=["type"])
+    assert feed["type"].to_list()[-1] == "BOM.created"
+
+
+def test_undo_checkpoint(db_setup):
+    """undo restores from checkpoint, history after it is not needed"""
+    dev = pd.DataFrame(
+        {
+            "hash": ["h1", "h2", "h3"],
+            "device_id": ["d1", "d2", "d3"],
+            "device_manufacturer": "m",
+            DEV_DESC: ["a", "x", "y"],
+        }
+    )
+    sql.put(dev.iloc[:1], "DEVICE")
+    time.sleep(1)
+    undo_date = int(time.time())
+    sql.put(dev.iloc[1:2], "DEVICE")
+    time.sleep(1)
+    checkpoint_date = int(time.time())
+    assert sql.checkpoint(checkpoint_date, force=True)
+    sql.put(dev.iloc[[0, 2]].assign(**{DEV_DESC: "b"}), "DEVICE")
+    state = sql.state_at("DEVICE", checkpoint_date)
+    assert sorted(state["hash"].to_list()) == ["h1", "h2"]
+    assert state.loc[state["hash"] == "h1", DEV_DESC].to_list() == ["a"]
+    state = sql.state_at("DEVICE", undo_date)
+    assert state["hash"].to_list() == ["h1"]
+    # history after checkpoint is not replayed
+    sql_core.__cmd_execute__(
+        ["DELETE FROM audite_changefeed WHERE time >= ?"], [str(checkpoint_date)]
+    )
+    sql.undo(undo_date)
+    devices = sql.getDF(tab="DEVICE")
+    assert devices["hash"].to_list() == ["h1"]
+    assert devices[DEV_DESC].to_list() == ["a"]
+    assert sql.checkpoint_list().empty
+
+
+def test_undo_shop_dates(db_setup, tmpdir, cli):
+    """dates of batch audited rows are written back as stored"""
+    with open(tmpdir.join("shop.csv"), "w", encoding="UTF8") as f:
+        f.write("device_id,device_manufacturer,order_qty,price\n" + "aa,bb,1,10")
+    args = cli.parse_args(["shop", "-d", tmpdir.strpath, "-F", "csv"])
+    shop_import(args)
+    time.sleep(1)
+    undo_date = int(time.time())
+    shop_import(args)
+    sql.undo(undo_date)
+    shop = sql.getDF(tab="SHOP")
+    assert len(shop) == 1
+    cmd = "SELECT typeof(date) AS t FROM SHOP"
+    assert sql_core.__cmd_execute__([cmd])[cmd]["t"].to_list() == ["text"]
+
+
+def test_checkpoint_restore_shop(db_setup, tmpdir, cli):
+    """checkpoint keeps SHOP dates as stored, same second changes are undone"""
+    with open(tmpdir.join("shop.csv"), "w", encoding="UTF8") as f:
+        f.write("device_id,device_manufacturer,order_qty,price\n" + "aa,bb,1,10")
+    args = cli.parse_args(["shop", "-d", tmpdir.strpath, "-F", "csv"])
+    shop_import(args)
+    date = sql.getDF(tab="SHOP")["date"].to_list()
+    time.sleep(1)
+    checkpoint_date = int(time.time())
+    sql.rm(tab="SHOP")
+    assert sql.checkpoint(checkpoint_date, force=True)
+    sql.rm(tab="DEVICE")
+    sql.restore_checkpoint(checkpoint_date)
+    assert sql.getDF(tab="SHOP").empty
+    assert len(sql.getDF(tab="DEVICE")) == 1
+    sql.undo(checkpoint_date)
+    assert sql.getDF(tab="SHOP")["date"].to_list() == date
+    cmd = "SELECT typeof(date) AS t FROM SHOP"
+    assert sql_core.__cmd_execute__([cmd])[cmd]["t"].to_list() == ["text"]
+    assert sql.state_at("SHOP", checkpoint_date)["date"].to_list() == [
+        date[0].isoformat()
+    ]
+
+
+def test_state_at_cmd(db_setup, cli, monkeypatch, capsys):
+    """admin --state_at shows table before selected command, old checkpoints go"""
+    monkeypatch.setattr(conf, "CHECKPOINT_KEEP", 1)
+    dev = pd.DataFrame(
+        {"hash": ["h1", "h2"], "device_id": ["d1", "d2"], "device_manufacturer": "m"}
+    )
+    sql.put(dev.iloc[:1], "DEVICE")
+    assert sql.checkpoint(1, force=True)
+    assert sql.checkpoint(2, force=True)
+    assert sql.checkpoint_list()[conf.CHECKPOINT_DATE].to_list() == [2]
+    time.sleep(1)
+    log.log_on = True
+    sql.put(dev.iloc[1:], "DEVICE")
+    # last command selected
+    with patch("app.admin.msg.select_log", return_value=1):
+        admin(cli.parse_args(["admin", "--state_at", "device"]))
+    out, _ = capsys.readouterr()
+    assert "d1" in out
+    assert "d2" not in out
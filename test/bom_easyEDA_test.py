@@ -3,7 +3,11 @@
 import pandas as pd
 import pytest
 
-from app.import_dat import bom_import
+from app import import_dat
+from app.import_dat import bom_import, import_file, parse_file
+from app.sql import getDF
+from conf import config as conf
+from conf.config import BOM_QTY, DEV_DESC, DEV_ID, DEV_MAN
 from inv import cli_parser
 
 
@@ -49,3 +53,83 @@ def test_bom_import_easyEDA1(cli, db_setup, tmpdir):  # pylint: disable=invalid-
     common_cols = exp.columns.intersection(inp.columns)
     exp = exp[common_cols]
     assert exp.equals(inp[common_cols])
+
+
+def test_bom_import_easyEDA_stream(  # pylint: disable=invalid-name
+    cli, db_setup, tmpdir, monkeypatch
+):
+    """big xlsx is streamed in chunks, with the same result"""
+    monkeypatch.setattr(conf, "XLSX_STREAM_SIZE", 0)
+    monkeypatch.setattr(conf, "IMPORT_CHUNK_ROWS", 2)
+    raw = pd.DataFrame(
+        {
+            "Quantity": [1, 2, 3, 4, 5],
+            "Value": ["1uF", None, "-", "10k", "1k"],
+            "Manufacturer Part": ["P1", "P2", "P3", "P4", None],
+            "Manufacturer": "YAGEO(国巨)",
+            "Description": "desc",
+            "Junk": "x",
+        }
+    )
+    raw.to_excel(tmpdir.join("text.xlsx"), index=False)
+
+    args = cli.parse_args(["bom", "-d", tmpdir.strpath])
+    bom_import(args)
+
+    bom = getDF(tab="BOM", follow=True).sort_values(by=DEV_ID)
+    assert bom[DEV_ID].to_list() == ["P1", "P2", "P3", "P4"]
+    assert bom[BOM_QTY].to_list() == [1, 2, 3, 4]
+    assert bom[DEV_DESC].to_list() == ["1uF : desc", "desc", "desc", "10k : desc"]
+    assert set(bom[DEV_MAN]) == {"YAGEO"}
+
+
+def test_xlsx_stream_as_xls(cli, db_setup, tmpdir, monkeypatch):
+    """the same file read and prepared both ways is equal"""
+    monkeypatch.setattr(conf, "IMPORT_CHUNK_ROWS", 2)
+    raw = pd.DataFrame(
+        {
+            "Quantity": [1, 2, None, 4, 5, 6],
+            "Value": ["1uF", "NA", None, "-", "10k", "1k"],
+            "Manufacturer Part": ["P1", "P2", None, "P4", "P5", None],
+            "Manufacturer": ["YAGEO(国巨)", "YAGEO", None, "man", "man", "man"],
+            "Supplier Footprint": ["0603", None, None, "NA", "0805", "1206"],
+        }
+    )
+    file = tmpdir.join("text.xlsx").strpath
+    raw.to_excel(file, index=False)
+    args = cli.parse_args(["bom", "-d", tmpdir.strpath])
+
+    dat = import_file(args, file)
+    prepared = parse_file(args, file, "BOM")
+    monkeypatch.setattr(conf, "XLSX_STREAM_SIZE", 0)
+    dat_stream = pd.concat(import_file(args, file))
+    prepared_stream = pd.concat(parse_file(args, file, "BOM"))
+
+    pd.testing.assert_frame_equal(dat, dat_stream)
+    pd.testing.assert_frame_equal(prepared, prepared_stream)
+
+
+def test_bom_import_stream_chunks(cli, db_setup, tmpdir, monkeypatch):
+    """streamed file is written chunk by chunk"""
+    monkeypatch.setattr(conf, "XLSX_STREAM_SIZE", 0)
+    monkeypatch.setattr(conf, "IMPORT_CHUNK_ROWS", 2)
+    raw = pd.DataFrame(
+        {
+            "Quantity": [1, 2, 3, 4, 5],
+            "Manufacturer Part": ["P1", "P2", "P3", "P4", "P5"],
+            "Manufacturer": "man",
+        }
+    )
+    raw.to_excel(tmpdir.join("text.xlsx"), index=False)
+    written = []
+    commit = import_dat.ImportSession.commit
+
+    def count_commit(self):
+        written.append(sum(len(d) for d in self.dat))
+        commit(self)
+
+    monkeypatch.setattr(import_dat.ImportSession, "commit", count_commit)
+    args = cli.parse_args(["bom", "-d", tmpdir.strpath])
+    bom_import(args)
+    assert [w for w in written if w] == [2, 2, 1]
+    assert len(getDF(tab="BOM")) == 5
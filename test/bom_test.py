@@ -3,8 +3,17 @@
 import pandas as pd
 import pytest
 
-from app.import_dat import bom_import, scan_files
+from app import tabs
+from app.import_dat import (
+    bom_import,
+    import_csv,
+    init_worker,
+    read_args,
+    scan_files,
+)
 from app.sql import check, getDF
+from app.sql_connection import connection
+from conf import config as conf
 from conf.config import BOM_QTY, DEV_ID
 from inv import cli_parser
 
@@ -443,3 +452,93 @@ def test_stock_import_overwrite_no_existing_data(db_setup, cli, tmpdir):
     stock1 = getDF(tab="BOM", follow=True)
     assert stock1.loc[stock1[DEV_ID] == "dev1", BOM_QTY].iloc[0] == 10
     assert stock1.loc[stock1[DEV_ID] == "dev2", BOM_QTY].iloc[0] == 20
+
+
+def test_import_csv_pushdown(db_setup, tmpdir):
+    """only known columns are read, typed already"""
+    test = tmpdir.join("test.csv")
+    with open(test, "w", encoding="UTF8") as f:
+        f.write(
+            "Device_ID,device_manufacturer,qty,project,junk\n"
+            + "aa,bb,1,test,x"
+        )# fmt: skip
+    dat = import_csv(test.strpath)
+    assert dat.columns.to_list() == [
+        "Device_ID",
+        "device_manufacturer",
+        "qty",
+        "project",
+    ]
+    assert dat["qty"].dtype == "Int64"
+
+
+def test_read_args_formatter(db_setup):
+    """formats with formatter function are read whole and raw"""
+    columns = pd.Index(["Quantity", "Value", "Qty", "junk"])
+    assert "usecols" not in read_args("easyEDA", columns)
+    assert "dtype" not in read_args("easyEDA", columns)
+    assert read_args("csv", columns)["usecols"] == ["Qty"]
+
+
+def test_bom_import_parallel(db_setup, cli, tmpdir, monkeypatch):
+    """files parsed in process pool, written in files order"""
+    monkeypatch.setattr(conf, "IMPORT_WORKERS", 2)
+    for i in range(3):
+        with open(tmpdir.join(f"proj{i}.csv"), "w", encoding="UTF8") as f:
+            f.write(
+                "device_id,device_manufacturer,qty\n"
+                + f"dev{i},man,{i + 1}\n"
+                + "dev_common,man,1"
+            )
+    args = cli.parse_args(["bom", "-d", tmpdir.strpath, "-F", "csv"])
+    bom_import(args)
+    bom = getDF(tab="BOM")
+    assert sorted(bom["project"].unique()) == ["proj0", "proj1", "proj2"]
+    assert len(bom) == 6
+
+
+def test_bom_import_worker_init(db_setup, monkeypatch):
+    """worker do not use db connection of parent, has config of parent"""
+    getDF(tab="BOM")
+    monkeypatch.setattr(conf, "IMPORT_CHUNK_ROWS", conf.IMPORT_CHUNK_ROWS)
+    init_worker({"IMPORT_CHUNK_ROWS": 5})
+    assert connection.con is None
+    assert conf.IMPORT_CHUNK_ROWS == 5
+    connection.detached.pop().close()
+
+
+def test_bom_import_ask_before_write(db_setup, cli, tmpdir, monkeypatch):
+    """user is asked outside of transaction, nothing written if refused"""
+    with open(tmpdir.join("proj.csv"), "w", encoding="UTF8") as f:
+        f.write("device_id,device_manufacturer,qty\n" + "dev,man,1")
+    args = cli.parse_args(["bom", "-d", tmpdir.strpath, "-F", "csv"])
+    bom_import(args)
+    depth = []
+
+    def ask(project):  # pylint: disable=unused-argument
+        depth.append(connection.depth)
+        return False
+
+    monkeypatch.setattr(tabs.msg, "project_already_imported", ask)
+    bom_import(args)
+    assert depth == [0]
+    assert getDF(tab="BOM")[BOM_QTY].to_list() == [1]
+
+
+def test_bom_import_coalesce(db_setup, cli, tmpdir, capsys):
+    """devices shared by files written once, summary per file"""
+    for i in range(2):
+        with open(tmpdir.join(f"proj{i}.csv"), "w", encoding="UTF8") as f:
+            f.write(
+                "device_id,device_manufacturer,device_description,qty\n"
+                + f"dev{i},man,desc,{i + 1}\n"
+                + f"dev_common,man,desc{i},1"
+            )
+    args = cli.parse_args(["bom", "-d", tmpdir.strpath, "-F", "csv"])
+    bom_import(args)
+    dev = getDF(tab="DEVICE")
+    assert len(dev) == 3
+    assert len(getDF(tab="BOM")) == 4
+    out = capsys.readouterr().out
+    assert out.count("______SUMMARY_______") == 2
+    assert "1 existing devices" in out
@@ -4,19 +4,23 @@ import importlib
 import json
 import os
 
+import pandas as pd
 import pytest
 
-from app import admin, common, message
+from app import admin, common, message, sql
 from app.common import (
     backup_config,
     check_dir_file,
     find_files,
     first_diff_index,
     foreign_tabs,
+    int_to_date_log,
     list_backups,
     read_json_dict,
     read_json_list,
+    read_scheme,
     restore_config,
+    tab_cols,
 )
 from app.error import CheckDirError, ReadJsonError, ScanDirPermissionError
 from app.import_dat import bom_import
@@ -128,6 +132,21 @@ def test_log1(db_setup, cli, tmpdir):
     assert len(logs) == 1
 
 
+def test_log_read_last(db_setup):
+    """only last n commands, oldest first, numbered from last"""
+    log.log_on = False
+    sql.put(
+        pd.DataFrame(
+            {conf.LOG_DATE: [1000, 3000, 2000], conf.LOG_ARGS: ["a", "c", "b"]}
+        ),
+        "LOG",
+    )
+    logs = log.log_read(2)
+    assert logs[conf.LOG_ARGS].to_list() == ["b", "c"]
+    assert logs["id"].to_list() == [2, 1]
+    assert logs["date_fmt"].to_list() == [int_to_date_log(2000), int_to_date_log(3000)]
+
+
 def test_find_files1():
     """lack of permissions"""
     with pytest.raises(ScanDirPermissionError) as err_info:
@@ -222,6 +241,20 @@ def test_foreign_tabs1(monkeypatch, tmpdir):
     assert tabs == ["tab2", "tab3"]
 
 
+def test_read_scheme1(monkeypatch, tmpdir):
+    """scheme parsed once, parsed again when file changed"""
+    fscheme = tmpdir.join("scheme.json")
+    fscheme.write(json.dumps({"tab1": {"col1": "TEXT NOT NULL", "col2": "TEXT"}}))
+    monkeypatch.setattr(conf, "SQL_SCHEME", fscheme)
+    assert read_scheme() is read_scheme()
+    must, _ = tab_cols("tab1")
+    must.append("col3")
+    assert tab_cols("tab1") == (["col1"], ["col2"])
+    fscheme.write(json.dumps({"tab1": {"col1": "TEXT NOT NULL", "col3": "TEXT"}}))
+    os.utime(fscheme, ns=(0, 10**9))
+    assert tab_cols("tab1") == (["col1"], ["col3"])
+
+
 def test_store_alternatives1(monkeypatch, db_setup):
     """default behavior"""
     man_alts = {
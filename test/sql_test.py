@@ -4,6 +4,7 @@ import importlib
 import json
 import os
 
+import pandas as pd
 import pytest
 
 from app import admin, common, sql, sql_core
@@ -11,11 +12,14 @@ from app.error import (
     CheckDirError,
     SqlCheckError,
     SqlCreateError,
+    SqlExecuteError,
 )
 from app.manufacturers import (
     get_alt_man,
 )
+from app.sql_connection import connection
 from conf import config as conf
+from inv import read_only_cmd
 
 
 def test_sql_create1(db_setup):
@@ -239,3 +243,270 @@ def test_sql_no_manufacturer(db_setup):
     with pytest.raises(SqlCheckError) as err_info:
         sql.check()
     assert err_info.match("Consider upgrading DB file")
+
+
+def test_sql_schema_cache(db_setup):
+    """schema info cached, but refreshed after DDL command"""
+    cols = sql_core.__tab_columns__("STOCK")
+    cols.add("not_a_column")
+    assert "not_a_column" not in sql_core.__tab_columns__("STOCK")
+    sql_core.__cmd_execute__(["ALTER TABLE STOCK ADD COLUMN new_col TEXT"])
+    assert "new_col" in sql_core.__tab_columns__("STOCK")
+    assert "new_col" in sql_core.__table_definition__("STOCK")
+
+
+def test_sql_get_follow(db_setup):
+    """follow=True joins FOREIGN tables in sql"""
+    dev = pd.DataFrame(
+        {"hash": ["h1", "h2"], "device_id": ["d1", "d2"], "device_manufacturer": "m"}
+    )
+    sql.put(dev, "DEVICE")
+    bom = pd.DataFrame({"device_hash": ["h1", "h2"], "qty": [1, 2], "project": "p"})
+    sql.put(bom, "BOM")
+    resp = sql.getDF("BOM", search=["d2"], where=["device_id"], follow=True)
+    assert resp["qty"].to_list() == [2]
+    assert {"hash", "device_hash", "project", "device_id"} <= set(resp.columns)
+    resp = sql.getDF(
+        "BOM", get_col=["qty"], search=["none"], where=["project"], follow=True
+    )
+    assert resp.empty
+    assert resp.columns.to_list() == ["qty"]
+
+
+def test_sql_get_follow_two_foreign(monkeypatch, tmpdir):
+    """columns named and ordered as pandas merge, also for renamed FOREIGN col"""
+    json_txt = {
+        "DEVICE": {
+            "hash": "TEXT PRIMARY KEY",
+            "project": "TEXT",
+            "note": "TEXT",
+        },
+        "PROJECT": {"project": "TEXT PRIMARY KEY", "note": "TEXT"},
+        "BOM": {
+            "id": "INTEGER PRIMARY KEY",
+            "device_hash": "TEXT NOT NULL",
+            "project": "TEXT NOT NULL",
+            "note": "TEXT",
+            "FOREIGN": [
+                {"device_hash": "DEVICE(hash)"},
+                {"project": "PROJECT(project)"},
+            ],
+        },
+    }
+    jfile = tmpdir.join("json.txt")
+    jfile.write(json.dumps(json_txt))
+    monkeypatch.setattr(conf, "DB_FILE", tmpdir.strpath + "db.sql")
+    monkeypatch.setattr(conf, "SQL_SCHEME", jfile)
+    monkeypatch.setattr(sql_core, "sql_scheme", common.read_json_dict(conf.SQL_SCHEME))
+    importlib.reload(sql)
+    importlib.reload(sql_core)
+    importlib.reload(common)
+    sql_core.__create__()
+    sql_core.__cmd_execute__(
+        [
+            "INSERT INTO DEVICE VALUES ('h1', 'dev_p', 'dev_n')",
+            "INSERT INTO PROJECT VALUES ('p1', 'proj_n')",
+            "INSERT INTO BOM VALUES (1, 'h1', 'p1', 'bom_n')",
+        ]
+    )
+    resp = sql.getDF("BOM", follow=True)
+    assert resp.columns.to_list() == [
+        "id",
+        "device_hash",
+        "project_x",
+        "note_x",
+        "hash",
+        "project_y",
+        "note_y",
+        "note",
+    ]
+    assert resp.iloc[0].to_list() == [
+        1,
+        "h1",
+        "p1",
+        "bom_n",
+        "h1",
+        "dev_p",
+        "dev_n",
+        "proj_n",
+    ]
+
+
+def test_sql_long_search(db_setup):
+    """search lists longer then SQL_MAX_PARAMS go through temp table"""
+    n = sql_core.SQL_MAX_PARAMS + 100
+    hashes = [f"h{i}" for i in range(n)]
+    dev = pd.DataFrame(
+        {"hash": hashes, "device_id": hashes, "device_manufacturer": "m"}
+    )
+    sql.put(dev, "DEVICE")
+    resp = sql.getL("DEVICE", get_col=["hash"], search=hashes, where=["hash"])
+    assert len(resp) == n
+    bom = pd.DataFrame({"device_hash": hashes, "qty": 1, "project": "p"})
+    sql.put(bom, "BOM")
+    resp = sql.getDF("BOM", search=hashes, where=["device_id"], follow=True)
+    assert len(resp) == n
+    sql.rm("BOM", value=hashes[1:], column=["device_hash"])
+    sql.rm("DEVICE", value=hashes[1:], column=["hash"])
+    assert sql.getL("DEVICE", get_col=["hash"]) == ["h0"]
+
+
+def test_sql_long_search_lazy(db_setup):
+    """lazy reader keeps own keys, while other long search runs"""
+    n = sql_core.SQL_MAX_PARAMS + 100
+    hashes = [f"h{i}" for i in range(2 * n)]
+    dev = pd.DataFrame(
+        {"hash": hashes, "device_id": hashes, "device_manufacturer": "m"}
+    )
+    sql.put(dev, "DEVICE")
+    chunks = sql.getDF("DEVICE", search=hashes[:n], where=["hash"], chunksize=100)
+    other = sql.getL("DEVICE", get_col=["hash"], search=hashes[n:], where=["hash"])
+    assert sorted(other) == sorted(hashes[n:])
+    got = pd.concat(chunks)["hash"].to_list()
+    assert sorted(got) == sorted(hashes[:n])
+
+
+def test_sql_get_multi_where(db_setup):
+    """all where columns are searched in one statement and split per column"""
+    dev = pd.DataFrame(
+        {
+            "hash": ["h1", "h2", "h3"],
+            "device_id": ["x", "h1", "y"],
+            "device_manufacturer": "m",
+        }
+    )
+    sql.put(dev, "DEVICE")
+    resp = sql_core.__get__(
+        "DEVICE", get_col=["hash"], search=["h1"], where=["hash", "device_id"]
+    )
+    assert resp["hash"]["hash"].to_list() == ["h1"]
+    assert resp["device_id"]["hash"].to_list() == ["h2"]
+    resp = sql_core.__get__(
+        "DEVICE", get_col=["hash"], search=["x"], where=["hash", "device_id"]
+    )
+    assert resp["hash"].empty
+    assert resp["device_id"]["hash"].to_list() == ["h1"]
+
+
+def test_sql_transaction(db_setup):
+    """transaction writes all or nothing"""
+    dev = pd.DataFrame(
+        {"hash": ["h1"], "device_id": ["d1"], "device_manufacturer": "m"}
+    )
+    with pytest.raises(KeyboardInterrupt):
+        with sql.transaction():
+            sql.put(dev, "DEVICE")
+            raise KeyboardInterrupt
+    assert sql.getL("DEVICE", get_col=["hash"]) == []
+    assert sql.getDF("LOG").empty
+    with sql.transaction():
+        sql.put(dev, "DEVICE")
+        with sql.transaction():
+            sql.put(dev.assign(hash="h2"), "DEVICE")
+    assert sorted(sql.getL("DEVICE", get_col=["hash"])) == ["h1", "h2"]
+    assert len(sql.getDF("LOG")) == 1
+
+
+def test_sql_get_chunks(db_setup):
+    """getDF with chunksize yields DataFrames of bounded size"""
+    hashes = [f"h{i}" for i in range(25)]
+    dev = pd.DataFrame(
+        {"hash": hashes, "device_id": hashes, "device_manufacturer": "m"}
+    )
+    sql.put(dev, "DEVICE")
+    chunks = list(sql.getDF("DEVICE", chunksize=10))
+    assert [len(c) for c in chunks] == [10, 10, 5]
+    chunks = list(sql.getDF("DEVICE", search=hashes[:12], where=["hash"], chunksize=10))
+    assert sorted(pd.concat(chunks)["hash"]) == sorted(hashes[:12])
+    assert not list(sql.getDF("DEVICE", search=["none"], where=["hash"], chunksize=10))
+
+
+def test_sql_index(db_setup):
+    """INDEX from sql_scheme created with db and restored by check()"""
+    assert sql_core.__missing_index__("BOM") == []
+    assert "project" in sql_core.__sqlite_master__("index_BOM_project")
+    sql_core.__cmd_execute__(["DROP INDEX index_BOM_project"])
+    assert sql_core.__missing_index__("BOM") == ["index_BOM_project"]
+    sql.check()
+    assert sql_core.__missing_index__("BOM") == []
+    plan = sql_core.__cmd_execute__(
+        ["EXPLAIN QUERY PLAN SELECT * FROM BOM WHERE project = 'p'"]
+    )
+    assert "index_BOM_project" in plan.popitem()[1].to_string()
+
+
+def test_sql_write_batches(db_setup, monkeypatch):
+    """writing in batches, NA written as NULL"""
+    monkeypatch.setattr(sql_core, "SQL_WRITE_BATCH", 2)
+    dev = pd.DataFrame(
+        {
+            "hash": ["h1", "h2", "h3"],
+            "device_id": ["d1", "d2", "d3"],
+            "device_manufacturer": "m",
+            "package": [None, float("nan"), "p"],
+        }
+    )
+    resp = sql.put(dev, "DEVICE")
+    assert resp["rows"] == 3
+    dat = sql.getDF("DEVICE", get_col=["hash", "package"])
+    assert dat.sort_values("hash")["package"].to_list() == [None, None, "p"]
+
+
+def test_sql_edit(db_setup):
+    """edit many rows with one prepared statement"""
+    hashes = [f"h{i}" for i in range(3)]
+    dev = pd.DataFrame(
+        {"hash": hashes, "device_id": hashes, "device_manufacturer": "m"}
+    )
+    sql.put(dev, "DEVICE")
+    sql.put(pd.DataFrame({"device_hash": hashes, "stock_qty": 1}), "STOCK")
+    new_qty = pd.Series([5, 6, 7]).to_list()
+    sql.edit(
+        "STOCK", new_val=new_qty, col="stock_qty", search=hashes, where="device_hash"
+    )
+    stock = sql.getDF("STOCK").sort_values("device_hash")
+    assert stock["stock_qty"].to_list() == [5, 6, 7]
+    # text with quote, only searched row changed
+    sql.edit(
+        "DEVICE",
+        new_val=["it's"],
+        col="device_description",
+        search=["h0"],
+        where="hash",
+    )
+    dev = sql.getDF("DEVICE").sort_values("hash")
+    assert dev["device_description"].to_list() == ["it's", None, None]
+
+
+def test_sql_read_only(db_setup, cli):
+    """read-only commands open db with mode=ro"""
+    assert read_only_cmd(cli.parse_args(["stock", "--fzf"]))
+    assert read_only_cmd(cli.parse_args(["admin", "-c"]))
+    assert not read_only_cmd(cli.parse_args(["stock", "--add_project", "p"]))
+    assert not read_only_cmd(cli.parse_args(["bom_import", "-d", "."]))
+    dev = pd.DataFrame(
+        {"hash": ["h1"], "device_id": ["d1"], "device_manufacturer": "m"}
+    )
+    sql.put(dev, "DEVICE")
+    sql.log.log_on = False
+    connection.read_only = True
+    try:
+        assert sql.getDF("DEVICE")["hash"].to_list() == ["h1"]
+        with pytest.raises(SqlExecuteError):
+            sql.put(dev.assign(hash="h2"), "DEVICE")
+    finally:
+        connection.read_only = False
+    sql.put(dev.assign(hash="h2"), "DEVICE")
+    assert len(sql.getDF("DEVICE")) == 2
+
+
+def test_read_only_admin(cli):
+    """admin -c is read-only only without other admin action"""
+    with pytest.raises(SystemExit):
+        cli.parse_args(["admin", "-c", "--undo", "1"])
+    args = cli.parse_args(["admin", "--undo", "1"])
+    args.display_config = True
+    assert not read_only_cmd(args)
+    args = cli.parse_args(["admin", "--prune_log"])
+    args.display_config = True
+    assert not read_only_cmd(args)
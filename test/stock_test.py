@@ -433,3 +433,40 @@ def test_stock_import_overwrite_no_existing_data(db_setup, cli, tmpdir):
     stock1 = getDF(tab="STOCK", follow=True)
     assert stock1.loc[stock1[DEV_ID] == "dev1", STOCK_QTY].iloc[0] == 10
     assert stock1.loc[stock1[DEV_ID] == "dev2", STOCK_QTY].iloc[0] == 20
+
+
+def test_use_project_partly_zeroed(db_setup, cli, tmpdir):
+    """
+    zeroed devices are removed and the rest of stock still decreased
+    """
+    _setup_bom_for_commit_test(cli, tmpdir, db_setup)
+    #     + "dev1,MAN_A,10,proj1\n"
+    #     + "dev2,MAN_B,20,proj1\n"
+    args = cli.parse_args(["stock", "--add_p", "proj1"])
+    add_stock(args)
+    args = cli.parse_args(
+        ["stock", "--add_device_id", "dev2", "--add_device_manufacturer", "MAN_B"]
+    )
+    add_stock(args)
+    args = cli.parse_args(["stock", "--use_pro", "proj1"])
+    stock_import(args)
+    stock = getDF(tab="STOCK", follow=True)
+    assert stock[DEV_ID].to_list() == ["dev2"]
+    assert stock[STOCK_QTY].to_list() == [1]
+
+
+def test_use_dev_with_quote(db_setup, cli, tmpdir):
+    """device_id and manufacturer with quote are found"""
+    with open(tmpdir.join("bom.csv"), "w", encoding="UTF8") as f:
+        f.write("device_id,device_manufacturer,qty,project\n" + "it's,O'MAN,1,proj1\n")
+    bom_import(cli.parse_args(["bom", "-d", tmpdir.strpath, "-F", "csv"]))
+    args = cli.parse_args(
+        ["stock", "--add_device_id", "it's", "--add_device_manufacturer", "O'MAN"]
+    )
+    add_stock(args)
+    add_stock(args)
+    args = cli.parse_args(["stock", "--use_device_id", "it's"])
+    stock_import(args)
+    stock = getDF(tab="STOCK", follow=True)
+    assert stock[DEV_ID].to_list() == ["it's"]
+    assert stock[STOCK_QTY].to_list() == [1]
@@ -3,6 +3,7 @@ py test
 testing functions from app/tabs.py
 """
 
+import hashlib
 import importlib
 from unittest.mock import mock_open, patch
 
@@ -13,7 +14,7 @@ from app import common
 from app.common import tab_cols
 from app.error import SqlTabError, VimdiffSelError
 from app.manufacturers import align_other_cols
-from app.tabs import ASCII_txt, NA_rows
+from app.tabs import ASCII_col, ASCII_txt, NA_rows, hash_rows
 from app.vimdiff import vimdiff_selection
 from conf import config as conf
 
@@ -101,6 +102,43 @@ def test_ASCII_txt_ohm_conversion():  # pylint: disable=invalid-name
     assert ASCII_txt(pd.NA) is pd.NA
 
 
+def test_ASCII_col():  # pylint: disable=invalid-name
+    """whole column cleaned and stripped, other values kept"""
+    col = pd.Series([" 100Ω (示例) ", "(示例)", "  ", None, 5, "ok"], dtype=object)
+    assert ASCII_col(col).to_list() == ["100ohm", None, None, None, 5, "ok"]
+    assert ASCII_col(pd.Series([1, 2], dtype=object)).to_list() == [1, 2]
+
+
+def test_frame_formatters():
+    """built-in formatters work on whole DataFrame"""
+    df = pd.DataFrame(
+        {
+            "order_qty": ["10\\5", None],
+            "price": ["$1.5", "total"],
+            "value": ["1k", None],
+        }
+    )
+    df["device_description"] = ["res", "cap"]
+    assert conf.csvLCSC(df.copy())["order_qty"].to_list() == ["10", None]
+    mouser = conf.mouser(df.copy())
+    assert mouser["price"].to_list() == [1.5, 0]
+    assert mouser["order_qty"].to_list() == [1, 1]
+    easy = conf.easyEDA(df.copy())
+    assert easy["device_description"].to_list() == ["1k : res", "cap"]
+
+
+def test_hash_rows():
+    """same hash as str() of each value joined per row"""
+    df = pd.DataFrame(
+        {"a": ["x", None, "z"], "b": [1.5, None, 3], "c": [1, 2, 3], "d": "-"}
+    )
+    expected = [
+        hashlib.sha256("".join(str(r[c]) for c in ["a", "b", "c"]).encode()).hexdigest()
+        for _, r in df.iterrows()
+    ]
+    assert hash_rows(df, ["a", "b", "c"]).to_list() == expected
+
+
 def test_vimdiff_selection_handles_none_input():
     """
     Test that vimdiff_selection correctly handles a None value in its input list,